@@ -1,7 +1,8 @@
 # bouyomichan
 # Text to speech interface for BouyomiChan via socket.
+import asyncio
+import collections
 import enum
-import queue
 import socket
 import struct
 import threading
@@ -38,9 +39,16 @@ def talk(text: str, *, putq=True, **kwargs):
     volume : int default=-1 (0-100)
     voice : int  default=0 (1-8: AquesTalk, 10001-: SAPI5)
     timeout : float
-        timeout for socket
+        timeout for socket (connect timeout when queued)
     host : tuple
         address to connect
+    on_sent : callable
+        Called with no arguments after the text was sent (queue only).
+    priority : int default=lowest
+        0 is the most urgent; see Sender (queue only).
+    deadline : float default=Sender.max_age[priority]
+        Seconds the text may wait in the queue before it is dropped
+        (queue only).
 
     Raises
     ------
@@ -48,15 +56,33 @@ def talk(text: str, *, putq=True, **kwargs):
     """
     if putq:
         self = talk
-        if not hasattr(self, "q"):
-            self.q = queue.Queue()
-            self.th = threading.Thread(target=_talk_daemon, daemon=True)
-            self.th.start()
-        self.q.put((text, kwargs))
+        if not hasattr(self, "sender"):
+            self.sender = Sender()
+        self.sender.put(text, kwargs)
         return
 
     host = kwargs.get("host", DEFAULT_HOST)
     timeout = kwargs.get("timeout")
+    data = _pack(text, kwargs)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        if timeout is not None:
+            sock.settimeout(timeout)
+        sock.connect(host)
+        sock.sendall(data)
+
+    _log_sent(text, kwargs)
+
+
+def backlog():
+    """Lines queued by talk() plus BouyomiChan's own queue as last seen."""
+    sender = getattr(talk, "sender", None)
+    if sender is None:
+        return 0
+    return len(sender) + sender.tasks
+
+
+def _pack(text, kwargs):
     message = bytes(text, "utf-8")
     code = 0  # 0:UTF-8, 1:Unicode, 2:Shift-JIS
 
@@ -68,31 +94,346 @@ def talk(text: str, *, putq=True, **kwargs):
         kwargs.get("volume", -1),
         kwargs.get("voice", 0),
         code, len(message))
-    data += message
+    return data + message
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        if timeout is not None:
-            sock.settimeout(timeout)
-        sock.connect(host)
-        sock.sendall(data)
 
+def _log_sent(text, kwargs):
     if logger.isEnabledFor(logging.DEBUG):
         if len(text) > 40:
             text = text[:40] + "..."
         logger.debug(text + " " + str(kwargs))
 
 
-def _talk_daemon():
-    logger.debug("_talk_daemon started")
-    while True:
-        text, kwargs = talk.q.get()
+class Sender:
+    """Asynchronous sender behind talk().
+
+    An asyncio loop on a daemon thread writes the queued lines in order.
+    BouyomiChan reads one command per connection, so connections are
+    opened ahead for the waiting lines, at most `connections` at a time.
+    Each line goes to the connection that finished connecting first; the
+    server accepts connections in that order, so the lines stay in order
+    while the connect latency overlaps with sending.
+
+    Lines are queued by priority (0 is the most urgent) and the most
+    urgent one is sent first. A line older than `max_age` of its priority
+    is dropped; if `summaries` has a format for the priority, the dropped
+    lines are replaced by one line saying how many were dropped.
+    BouyomiChan's own queue is kept at most `max_tasks` long, checked with
+    gettalktaskcount, so that urgent lines do not wait behind it. The count
+    is asked again only when the lines sent since the last answer use up
+    the room it left. While BouyomiChan keeps up (answers 0) that room
+    doubles up to `max_burst` lines, so prefetching can overlap; as soon
+    as lines are waiting there it falls back to `max_tasks`.
+
+    Failures go through a circuit breaker. A failed line is retried up to
+    `retries` times. After `threshold` failures in a row the circuit opens:
+    lines are kept (at most `backlog`, least urgent dropped first) but
+    nothing is sent. After `retry_after` seconds a getnowplaying probe is
+    sent (half-open); if it answers the circuit closes and sending
+    resumes, otherwise it stays open and the wait doubles up to
+    `retry_after_max`.
+    """
+
+    connections = 4
+    connect_timeout = 1.0
+    max_age = (60.0, 30.0, 30.0, 15.0)  # seconds, by priority
+    max_tasks = 1  # None: do not check gettalktaskcount
+    max_burst = 8
+    poll_interval = 0.2
+    retries = 2
+    threshold = 3
+    backlog = 200
+    retry_after = 2.0
+    retry_after_max = 30.0
+
+    def __init__(self, host=DEFAULT_HOST, connections=None, summaries=None):
+        self.host = host
+        if connections is not None:
+            self.connections = connections
+        self.summaries = dict(summaries or {})  # priority -> format with {n}
+        # [text, kwargs, deadline, tries, priority]
+        self.queues = [collections.deque() for _ in self.max_age]
+        self.size = 0
+        self.budget = 0  # lines that can be sent before asking task count
+        self.burst = self.max_tasks or 1  # room while BouyomiChan keeps up
+        self.tasks = 0  # BouyomiChan's queue length when last asked
+        self.stats = collections.Counter()
+        self.state = "closed"  # "closed" | "open" | "half-open"
+        self.failures = 0  # consecutive
+        self.opened = 0.0
+        self.wait = self.retry_after
+        self.loop = asyncio.new_event_loop()
+        self.wakeup = None  # asyncio.Event, created on the loop
+        self.connected = None
+        self.connecting = set()
+        self.ready = collections.deque()  # in the order they connected
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.task = None
+        asyncio.run_coroutine_threadsafe(self._main(), self.loop)
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        """Stop the loop. Lines still queued are discarded."""
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def put(self, text, kwargs):
+        """Queue the text. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._put, text, dict(kwargs))
+
+    def _put(self, text, kwargs):
+        priority = kwargs.pop("priority", len(self.queues) - 1)
+        priority = min(max(priority, 0), len(self.queues) - 1)
+        ttl = kwargs.pop("deadline", self.max_age[priority])
+        if self.size >= self.backlog:
+            queue = next(q for q in reversed(self.queues) if q)
+            queue.popleft()
+            self.size -= 1
+            self.stats["dropped"] += 1
+        self._append(
+            [text, kwargs, self.loop.time() + ttl, 0, priority])
+        self.stats["queued"] += 1
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def _append(self, line, left=False):
+        queue = self.queues[line[4]]
+        if left:
+            queue.appendleft(line)
+        else:
+            queue.append(line)
+        self.size += 1
+
+    def _head(self):
+        for queue in self.queues:
+            if queue:
+                return queue
+        return None
+
+    def _expire(self):
+        now = self.loop.time()
+        for priority, queue in enumerate(self.queues):
+            n = 0
+            while queue and queue[0][2] <= now:
+                text = queue.popleft()[0]
+                logger.debug(f"talk expired: {text[:40]}")
+                n += 1
+            if not n:
+                continue
+            self.size -= n
+            self.stats["expired"] += n
+            summary = self.summaries.get(priority)
+            if summary is not None:
+                self._append([summary.format(n=n), {},
+                              now + self.max_age[priority], 0, priority],
+                             left=True)
+                self.stats["summarized"] += 1
+
+    def _prefetch(self, want):
+        while len(self.connecting) + len(self.ready) < want:
+            task = self.loop.create_task(self._connect(self.host))
+            self.connecting.add(task)
+            task.add_done_callback(self._on_connected)
+
+    def _on_connected(self, task):
+        self.connecting.discard(task)
+        if not task.cancelled():
+            self.ready.append(task)
+        if self.connected is not None:
+            self.connected.set()
+
+    async def _connect(self, host, timeout=None):
+        return await asyncio.wait_for(
+            asyncio.open_connection(*host),
+            self.connect_timeout if timeout is None else timeout)
+
+    def _discard_connections(self):
+        for task in self.connecting:
+            task.cancel()
+        while self.ready:
+            task = self.ready.popleft()
+            if task.exception() is None:
+                task.result()[1].close()
+
+    async def _command(self, cmdid):
+        """Async version of _cmd(). Raises on socket errors."""
+        reader, writer = await self._connect(self.host)
+        try:
+            writer.write(struct.pack("<h", cmdid))
+            buf = await asyncio.wait_for(
+                reader.read(4), self.connect_timeout)
+        finally:
+            writer.close()
+        return int.from_bytes(buf, "little")
+
+    async def _main(self):
+        self.task = asyncio.current_task()
+        self.wakeup = asyncio.Event()
+        self.connected = asyncio.Event()
+        try:
+            await self._run()
+        finally:
+            self._discard_connections()
+
+    async def _run(self):
+        while True:
+            self._expire()
+            queue = self._head()
+            if queue is None:
+                self._discard_connections()
+                self.burst = self.max_tasks or 1
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            if self.state == "open":
+                delay = self.opened + self.wait - self.loop.time()
+                if delay > 0:
+                    # wake up for the probe or to expire a line
+                    await asyncio.sleep(min(
+                        [delay] + [q[0][2] - self.loop.time()
+                                   for q in self.queues if q]))
+                    continue
+                await self._probe()
+                continue
+
+            if self.max_tasks is not None and self.budget <= 0:
+                # nothing is prefetched here, so the server can answer
+                await self._check_tasks()
+                continue
+
+            line = queue[0]
+            host = line[1].get("host", self.host)
+            if host != self.host:
+                # other hosts are not prefetched
+                queue.popleft()
+                self.size -= 1
+                try:
+                    conn = await self._connect(host, line[1].get("timeout"))
+                except (OSError, asyncio.TimeoutError) as e:
+                    self._failed(e, line)
+                    continue
+                await self._send(conn, line)
+                continue
+
+            want = min(self.connections, self.size)
+            if self.max_tasks is not None:
+                want = min(want, self.budget)
+            self._prefetch(want)
+            if not self.ready:
+                self.connected.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.connected.wait(), line[2] - self.loop.time())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # the most urgent line may have changed while connecting
+            queue = self._head()
+            line = queue.popleft()
+            self.size -= 1
+            task = self.ready.popleft()
+            e = task.exception()
+            if e is not None:
+                self._failed(e, line)
+                continue
+            await self._send(task.result(), line)
+
+    async def _check_tasks(self):
+        try:
+            count = await self._command(Cmd.GetTaskCount)
+        except (OSError, asyncio.TimeoutError) as e:
+            # leave it to sending to find out if the server is down
+            logger.debug(f"gettalktaskcount failed: {e!r}")
+            self.budget = 1
+            return
+        self.stats["task_checks"] += 1
+        self.tasks = count
+        if count:
+            self.burst = self.max_tasks
+        else:
+            self.burst = min(self.burst * 2, self.max_burst)
+        self.budget = self.burst - count
+        if self.budget <= 0:
+            self.stats["task_waits"] += 1
+            await asyncio.sleep(self.poll_interval)
+
+    async def _send(self, conn, line):
+        text, kwargs, deadline = line[:3]
+        _, writer = conn
+        try:
+            writer.write(_pack(text, kwargs))
+            if writer.transport.get_write_buffer_size():
+                await asyncio.wait_for(
+                    writer.drain(), max(0, deadline - self.loop.time()))
+        except (OSError, asyncio.TimeoutError) as e:
+            self._failed(e, line)
+            return
+        finally:
+            writer.close()
+        self.failures = 0
+        self.budget -= 1
+        self.stats["sent"] += 1
+        _log_sent(text, kwargs)
+        on_sent = kwargs.get("on_sent")
+        if on_sent is not None:
+            try:
+                on_sent()
+            except Exception as e:
+                logger.error(e)
+
+    def _failed(self, e, line):
+        self.stats["failed"] += 1
+        self.failures += 1
+        # the other prefetched connections are likely broken as well
+        self._discard_connections()
+        opening = self.failures >= self.threshold
+        # the line that opens the circuit waits for it to close again
+        if (opening or line[3] < self.retries) \
+                and line[2] > self.loop.time():
+            line[3] += 1
+            self._append(line, left=True)
+            self.stats["retried"] += 1
+        else:
+            self.stats["dropped"] += 1
+        if opening:
+            self._open(e)
+        else:
+            logger.debug(f"talk failed: {e!r}")
+
+    def _open(self, e):
+        if self.state == "closed":
+            logger.warning(f"BouyomiChan unavailable: {e!r}")
+            self.wait = self.retry_after
+        self.state = "open"
+        self.opened = self.loop.time()
+        self.stats["opened"] += 1
+
+    async def _probe(self):
+        self.state = "half-open"
+        self.stats["probes"] += 1
         try:
-            talk(text, **kwargs, putq=False)
-        except socket.error:
-            while not talk.q.empty():
-                talk.q.get_nowait()
-        except Exception as e:
-            logger.error(e)
+            await self._command(Cmd.GetNowPlaying)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.wait = min(self.wait * 2, self.retry_after_max)
+            self._open(e)
+            return
+        logger.info("BouyomiChan available")
+        self.state = "closed"
+        self.failures = 0
+        self.budget = 0
 
 
 def _cmd(host, cmdid: Cmd, timeout):
@@ -211,6 +552,6 @@ if __name__ == '__main__':
     for i, text in enumerate(voicez):
         talk(f"{i}番 {text}", voice=i, tone=125)
 
-    # _talk_daemonが動く猶予を与える
+    # Senderが動く猶予を与える
     from time import sleep
     sleep(5)
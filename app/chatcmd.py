@@ -1,3 +1,4 @@
+import collections
 import re
 
 cmd_rex = [
@@ -12,17 +13,62 @@ cmd_rex = [
     r'ce\d( +s(\d+(\.\d+)?))?',
     r'stamp +[^ ]',
 ]
-cmd_rex = r'^/(' + '|'.join(cmd_rex) + r') ?'
-cmd_rex = re.compile(cmd_rex)
+cmd_rex = '/(' + '|'.join(cmd_rex) + ') ?'
+# 先頭に並ぶコマンドを空白ごとまとめて一致させる
+lead_rex = re.compile(r'\s*(?:' + cmd_rex + r'\s*)*')
+cmd_rex = re.compile('^' + cmd_rex)
+# 発言中のどこにあっても拾うコマンド
+action_rex = re.compile(
+    '/(?:(?P<la>[cfm]?la)|'
+    '(?P<equip>skillring|sr|costume|cs|camouflage|cmf)|'
+    '(?P<stamp>stamp))'
+    ' +(?=(?P<arg>[^ ]+))')  # 引数の中のコマンドも拾えるよう先読みにする
 color_rex = re.compile(r'{(red|bei|gre|vio|blk|ora|yel|blu|pur|gra|whi|def)}')
 
+class ChatTokens(collections.namedtuple("ChatTokens", "commands colors text")):
+    """tokenizeの結果
+
+    commands : [(種類, 引数)] 種類は "la" "equip" "stamp"
+    colors : 色指定タグの色名のリスト
+    text : 先頭のコマンドと色指定を除いた、読み上げるべき文字列
+    """
+
+    __slots__ = ()
+
+    def arg(self, kind):
+        """最初に現れたkindのコマンドの引数を返す。無ければNone"""
+        for k, arg in self.commands:
+            if k == kind:
+                return arg
+        return None
+
+
+def _kind(m):
+    return 'la' if m.group('la') else 'equip' if m.group('equip') \
+        else 'stamp'
 
-def strip(text):
-    text = color_rex.sub('', text)
-    prev = None
 
-    while text and text != prev:
-        prev = text.lstrip()
-        text = cmd_rex.sub('', text).lstrip()
+def tokenize(text):
+    """チャットの発言を解析する
 
-    return text
+    色指定を除いた後、先頭に並ぶコマンドを一度の照合で読み飛ばし、
+    ロビアク・装備・スタンプのコマンドは発言中のどこにあっても拾う。
+    """
+    colors = []
+    if '{' in text:
+        parts = color_rex.split(text)
+        if len(parts) > 1:
+            colors = parts[1::2]
+            text = ''.join(parts[::2])
+
+    if '/' not in text:
+        return ChatTokens([], colors, text.lstrip())
+
+    commands = [
+        (_kind(m), m.group('arg')) for m in action_rex.finditer(text)]
+    lead = lead_rex.match(text).end()
+    return ChatTokens(commands, colors, text[lead:])
+
+
+def strip(text):
+    return tokenize(text).text
@@ -0,0 +1,148 @@
+"""読み上げの滞留に応じて発言をまとめる
+
+main.talkとbouyomichan.talkの間に入る。
+読み上げ待ちがthresholds[0]件以上の間は、スタンプ・装備・ロビアク等の通知を
+種類毎にwindow秒溜めてから1文にまとめて送る。
+thresholds[1]件以上になるとチャットの発言もまとめる。チャットは件数に
+置き換えず、発言を続けて読む1文にする (長い発言は切り詰める)。
+種類の無い文 (警告やアイテムの読み上げ) と、min_priorityより急ぐ優先度の文
+(ささやき等) は溜めずにそのまま送る。
+"""
+import collections
+
+# 種類: (1人が複数回の時, 複数人の時)
+FORMATS = {
+    "stamp": ("{name}のスタンプ{n}回", "{names}のスタンプ"),
+    "symbol": ("{name}のシンボルアート{n}回", "{names}のシンボルアート"),
+    "equip": ("{name}が装備を{n}回変更した", "{names}が装備を変更した"),
+    "la": ("{name}がロビアク{n}回", "{names}がロビアク"),
+}
+
+
+def names_text(names, limit=3):
+    text = "、".join(names[:limit])
+    if len(names) > limit:
+        text += f"ほか{len(names) - limit}人"
+    return text
+
+
+def shorten(text, limit):
+    """textの内容をlimit文字までに切り詰めて (文, 残した文字数) を返す
+
+    「」で終わる発言は閉じ括弧を残す。
+    """
+    if len(text) <= limit:
+        return text, len(text)
+    close = "」" if text.endswith("」") else ""
+    kept = text[:limit - len(close)]
+    return kept + "…" + close, len(kept) + len(close)
+
+
+class Coalescer:
+    """send(text, **kwargs) の前で発言をまとめる
+
+    backlogは読み上げ待ちの件数を返す関数。
+    kwargsのpriorityがmin_priorityより小さい (急ぐ) 文はまとめない。
+    チャットは1発言をchat_chars文字まで、1文にchat_lines件までつなぎ、
+    残りは件数だけ読む。
+
+    節約できた読み上げ時間は、減った文字数をspeech_rate (文字/秒) で、
+    減った文の数をline_gap (秒/文) で見積もる。
+    切り詰めや省略で読まなかったチャットの文字数はchars_droppedとして
+    別に数え、節約には含めない。
+    """
+
+    thresholds = (3, 8)
+    window = 2.0
+    speech_rate = 8.0
+    line_gap = 0.5
+    chat_chars = 30
+    chat_lines = 5
+
+    def __init__(self, send, scheduler, backlog, min_priority=0):
+        self.send = send
+        self.scheduler = scheduler
+        self.backlog = backlog
+        self.min_priority = min_priority
+        self.groups = collections.OrderedDict()  # (種類, kwargs) -> [(名前, 文)]
+        self.timer = None
+        self.stats = collections.Counter()
+
+    def level(self):
+        n = self.backlog()
+        return sum(n >= t for t in self.thresholds)
+
+    def put(self, text, kind=None, name=None, **kwargs):
+        urgent = kwargs.get("priority", self.min_priority) < self.min_priority
+        if urgent or kind is None or name is None \
+                or self.level() < (2 if kind == "chat" else 1):
+            self._send(text, kwargs)
+            return
+        kwargs.pop("on_sent", None)  # まとめた文には付けない
+        key = (kind, tuple(sorted(kwargs.items())))
+        self.groups.setdefault(key, []).append((name, text))
+        if self.timer is None:
+            self.timer = self.scheduler.call_later(self.window, self.flush)
+
+    def flush(self):
+        self.timer = None
+        groups, self.groups = self.groups, collections.OrderedDict()
+        for (kind, kwargs), lines in groups.items():
+            self._send(self.merge(kind, lines), dict(kwargs), lines)
+            self.stats["merged"] += len(lines) - 1
+
+    def merge(self, kind, lines):
+        if len(lines) == 1:
+            return lines[0][1]
+        if kind not in FORMATS:
+            return self.join(lines)
+        names = list(dict.fromkeys(name for name, _ in lines))
+        one, many = FORMATS[kind]
+        if len(names) == 1:
+            return one.format(name=names[0], n=len(lines))
+        return many.format(names=names_text(names), n=len(lines))
+
+    def join(self, lines):
+        """発言を切り詰めてつなぐ"""
+        texts = []
+        kept = 0
+        for _, text in lines[:self.chat_lines]:
+            text, n = shorten(text, self.chat_chars)
+            texts.append(text)
+            kept += n
+        text = "".join(texts)
+        rest = len(lines) - len(texts)
+        if rest:
+            text += f"ほか{rest}件"
+        self.stats["chars_dropped"] += sum(len(t) for _, t in lines) - kept
+        return text
+
+    def _send(self, text, kwargs, lines=None):
+        if lines is None:
+            lines = [(None, text)]
+        self.stats["lines_in"] += len(lines)
+        self.stats["chars_in"] += sum(len(t) for _, t in lines)
+        self.stats["lines_out"] += 1
+        self.stats["chars_out"] += len(text)
+        self.send(text, **kwargs)
+
+    def saved(self):
+        """節約できた読み上げ時間の見積もり (秒)
+
+        読まずに捨てた内容 (chars_dropped) の分は含めない。
+        """
+        s = self.stats
+        return ((s["chars_in"] - s["chars_out"] - s["chars_dropped"])
+                / self.speech_rate
+                + (s["lines_in"] - s["lines_out"]) * self.line_gap)
+
+    def dropped(self):
+        """読まずに捨てたチャットの読み上げ時間の見積もり (秒)"""
+        return self.stats["chars_dropped"] / self.speech_rate
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats.update(pending=sum(map(len, self.groups.values())),
+                     saved_s=round(self.saved(), 1),
+                     dropped_s=round(self.dropped(), 1))
+        return stats
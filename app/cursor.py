@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class CursorStore:
+    """ログファイル毎の読み取り位置を保存する
+
+    pathをキーに、inode・読み取り済みサイズ・位置・最後に配信したsequenceを
+    JSONファイルへ記録する。書き込みとfsyncはinterval秒毎にまとめて行う。
+    """
+
+    interval = 1.0
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = {}
+        self.dirty = False
+        self.flushed = time.monotonic()
+        try:
+            with self.path.open("rt", encoding="utf-8") as fp:
+                self.data = json.load(fp)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"{self.path}: {e}")
+
+    def get(self, path: Path, stat):
+        """再開できるカーソル (pos, seq) を返す。無効ならNone"""
+        cur = self.data.get(str(path))
+        if cur is None:
+            return None
+        if cur["ino"] != stat.st_ino or stat.st_size < cur["size"]:
+            logger.info(f"{path.name}: cursor discarded")
+            return None
+        return cur["pos"], cur["seq"]
+
+    def paths(self):
+        """カーソルのあるファイルのリスト"""
+        return [Path(key) for key in self.data]
+
+    def update(self, path: Path, ino, size, pos, seq):
+        self.data[str(path)] = {
+            "ino": ino, "size": size, "pos": pos, "seq": seq,
+        }
+        self.dirty = True
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.dirty and time.monotonic() - self.flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self.flushed = time.monotonic()
+        if not self.dirty:
+            return
+        self.dirty = False
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("wt", encoding="utf-8") as fp:
+            json.dump(self.data, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.path)
+
+    def forget(self, paths):
+        """現存しないファイルのカーソルを捨てる"""
+        keep = set(map(str, paths))
+        for key in list(self.data):
+            if key not in keep:
+                del self.data[key]
+                self.dirty = True
@@ -1,16 +1,23 @@
 import ctypes.wintypes
 import json
-import queue
+import logging
+import math
+import time
 import tkinter as tk
 import tkinter.ttk as ttk
 from pathlib import Path
 
-from . import logpump
+from . import logpump, tracing
+from .cursor import CursorStore
 from . import main as Main
 from .gui_config import ConfigPane
 from .gui_inventory import InventoryView
 from .gui_lalistview import LaListView
 from .gui_logview import LogView
+from .handoff import HandOff
+from .ledger import Ledger
+
+logger = logging.getLogger(__name__)
 
 
 class AppConfig:
@@ -21,6 +28,12 @@ class AppConfig:
     fontsize = 11
     geometry = ""
     rawlog = False
+    queue_size = 10000
+    queue_policy = "block"  # "block" | "drop"
+    tick_budget = 0.05  # 1回のloopでエントリ処理に使う時間(秒)
+    trace = False  # 処理段階毎の遅延を集計し、終了時にログへ出す
+    ledger = "ledger.db"  # 拾得物の台帳 (空なら記録しない)
+    coalesce_thresholds = [3, 8]  # 読み上げ待ちが何件から通知・チャットをまとめるか
 
     def load(self):
         try:
@@ -128,8 +141,13 @@ class App(tk.Tk):
             pass
 
     def mainloop(self):
-        q = queue.Queue()
-        pump = logpump.LogPump(q.put)
+        tracing.enable(self.conf.trace)
+        Main.coalescer.thresholds = tuple(self.conf.coalesce_thresholds)
+        if self.conf.ledger:
+            setattr(Main, "ledger", Ledger(self.conf.ledger, Main.scheduler))
+        q = HandOff(self.conf.queue_size, self.conf.queue_policy)
+        pump = logpump.LogPump(
+            q.put, cursors=CursorStore("logcursor.json"))
         pump.start()
 
         self.keep_running = True
@@ -144,15 +162,23 @@ class App(tk.Tk):
                 pass
 
         def loop():
-            while not q.empty():
-                ent = q.get_nowait()
-                rawlogger(ent)
-                Main.on_entry(ent)
-
-            Main.reporter.update()
+            # 大量に溜まっていてもUIが固まらないよう、処理時間を区切る
+            deadline = time.perf_counter() + self.conf.tick_budget
+            while time.perf_counter() < deadline:
+                batch = q.get_batch(100)
+                if not batch:
+                    break
+                for ent in batch:
+                    rawlogger(ent)
+                    Main.on_entry(ent)
+
+            Main.scheduler.run_pending()
 
             if self.keep_running:
-                self.after(500, loop)
+                # 残りがあればすぐに続きを処理する
+                # 無ければ次の予定の時刻か500ms後に起きる
+                wait = 0 if len(q) else Main.scheduler.timeout(0.5)
+                self.after(max(1, math.ceil(wait * 1000)), loop)
             else:
                 self.destroy()
 
@@ -160,7 +186,14 @@ class App(tk.Tk):
 
         super(App, self).mainloop()
 
+        q.close()
         pump.stop()
+        if Main.ledger is not None:
+            Main.ledger.close()
+        logger.info(f"queue: {q.snapshot()}")
+        logger.info(f"coalesce: {Main.coalescer.snapshot()}")
+        if tracing.enabled:
+            logger.info("trace\n" + tracing.dump())
 
 
 def main():
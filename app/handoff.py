@@ -0,0 +1,93 @@
+import collections
+import threading
+import time
+
+
+class HandOff:
+    """LogPumpのスレッドから消費側へエントリを受け渡す有界キュー
+
+    消費側はget_batchで溜まった分をまとめて一度に受け取る。
+    満杯になった時の振る舞いはpolicyで選ぶ。
+        "block": 空きができるまで生産側(LogPump)を待たせる
+        "drop": 最も古いエントリを捨てる
+    """
+
+    def __init__(self, maxsize=10000, policy="block"):
+        if policy not in ("block", "drop"):
+            raise ValueError(f"unknown policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.deq = collections.deque()  # (投入時刻, エントリ)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.stats = collections.Counter()
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __len__(self):
+        return len(self.deq)
+
+    def put(self, item):
+        with self.cond:
+            if len(self.deq) >= self.maxsize and not self.closed:
+                if self.policy == "drop":
+                    self.deq.popleft()
+                    self.stats["dropped"] += 1
+                else:
+                    self.stats["blocked"] += 1
+                    t = time.monotonic()
+                    while len(self.deq) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+                    self.stats["blocked_ms"] += int(
+                        (time.monotonic() - t) * 1000)
+            if self.closed:
+                self.stats["dropped"] += 1
+                return
+            self.deq.append((time.monotonic(), item))
+            self.stats["put"] += 1
+            self.max_depth = max(self.max_depth, len(self.deq))
+            self.cond.notify_all()
+
+    def get_batch(self, limit=None, timeout=0):
+        """溜まっているエントリを最大limit件まとめて返す
+
+        空の時はtimeout秒まで待つ (Noneなら無期限)。
+        """
+        with self.cond:
+            if not self.deq and timeout != 0 and not self.closed:
+                self.cond.wait(timeout)
+            deq = self.deq
+            n = len(deq) if limit is None else min(limit, len(deq))
+            if not n:
+                return []
+            now = time.monotonic()
+            # 先頭のエントリが最も長く待っている
+            self.wait_max = max(self.wait_max, now - deq[0][0])
+            batch = []
+            for _ in range(n):
+                t, item = deq.popleft()
+                self.wait_total += now - t
+                batch.append(item)
+            self.stats["get"] += n
+            self.stats["batches"] += 1
+            self.cond.notify_all()
+        return batch
+
+    def close(self):
+        """生産側・消費側の待ちを解除し、以後のputを捨てる"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def snapshot(self):
+        """キューの統計を辞書で返す"""
+        stats = dict(self.stats)
+        got = stats.get("get", 0)
+        stats.update(
+            depth=len(self.deq),
+            max_depth=self.max_depth,
+            wait_avg_ms=self.wait_total * 1000 / got if got else 0.0,
+            wait_max_ms=self.wait_max * 1000,
+        )
+        return stats
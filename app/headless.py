@@ -0,0 +1,163 @@
+"""GUIを使わずにログを読み取るエントリポイント
+
+tkinterやWin32のAPIには依存しないので、ディスプレイの無い環境でも動く。
+
+    python -m app.headless --root PATH/TO/log --root PATH/TO/log_ngs
+"""
+import argparse
+import importlib
+import json
+import logging
+import signal
+import threading
+from pathlib import Path
+
+from . import logpump, tracing
+from . import main as Main
+from .cursor import CursorStore
+from .handoff import HandOff
+from .ledger import Ledger
+
+logger = logging.getLogger(__name__)
+
+
+def sink_dispatch():
+    return Main.on_entry
+
+
+def sink_print():
+    def sink(ent):
+        print(ent, flush=True)
+    return sink
+
+
+def sink_null():
+    return lambda ent: None
+
+
+sinks = {
+    "dispatch": sink_dispatch,
+    "print": sink_print,
+    "null": sink_null,
+}
+
+
+def load_sink(name):
+    """名前からsinkを作る。"module:function" ならそのファクトリを呼ぶ"""
+    if name in sinks:
+        return sinks[name]()
+    module, _, attr = name.partition(":")
+    if not attr:
+        raise ValueError(f"unknown sink: {name}")
+    return getattr(importlib.import_module(module), attr)()
+
+
+class HeadlessConfig:
+    """config.json (GUIと共通) の内、ヘッドレスで使う項目"""
+
+    on = []
+    volume = 1.0
+    log_roots = []
+    sinks = ["dispatch"]
+    queue_size = 10000
+    queue_policy = "block"
+    coalesce_thresholds = [3, 8]
+
+    def __init__(self, path):
+        try:
+            with Path(path).open("rt", encoding="utf-8") as fp:
+                for attr, val in json.load(fp).items():
+                    setattr(self, attr, val)
+        except FileNotFoundError:
+            pass
+
+
+def run(roots, sink_fns, on=(), volume=1.0, backend=None, workers=None,
+        cursors=None, queue_size=10000, queue_policy="block", stop=None):
+    """stopがセットされるまでログを読み取り、エントリをsinkへ渡す"""
+    on = set(on)
+    setattr(Main, "get_config", lambda code: code in on)
+    setattr(Main, "get_volume", lambda: volume)
+
+    stop = threading.Event() if stop is None else stop
+    q = HandOff(queue_size, queue_policy)
+    pump = logpump.LogPump(q.put, roots, backend, cursors, workers)
+    pump.start()
+    try:
+        while not stop.is_set():
+            # 次の予定の時刻までエントリを待つ
+            for ent in q.get_batch(100, timeout=Main.scheduler.timeout(0.5)):
+                for sink in sink_fns:
+                    sink(ent)
+            Main.scheduler.run_pending()
+    finally:
+        q.close()
+        pump.stop()
+        logger.info(f"queue: {q.snapshot()}")
+        logger.info(f"reorder: {dict(pump.stats())}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.headless")
+    parser.add_argument("--config", default="config.json",
+                        help="設定ファイル (既定: config.json)")
+    parser.add_argument("--root", action="append", dest="roots",
+                        help="ログフォルダ (複数指定可)")
+    parser.add_argument("--sink", action="append", dest="sinks",
+                        help="dispatch | print | null | module:factory")
+    parser.add_argument("--on", help="有効にする機能の番号 (例: 100,102)")
+    parser.add_argument("--backend", choices=["inotify", "polling"])
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--cursor", help="読み取り位置を保存するファイル")
+    parser.add_argument("--ledger", help="拾得物を記録するSQLiteファイル")
+    parser.add_argument("--trace", action="store_true",
+                        help="処理段階毎の遅延を集計する (SIGUSR1で表示)")
+    parser.add_argument("--profile", action="store_true",
+                        help="ハンドラ毎の呼び出し回数と所要時間を集計する")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level,
+                        format='%(levelname)s : %(asctime)s : %(message)s')
+
+    conf = HeadlessConfig(args.config)
+    roots = args.roots or conf.log_roots
+    if not roots:
+        try:
+            roots = logpump.default_folders()
+        except (ImportError, AttributeError, OSError):
+            parser.error("--root is required on this platform")
+    on = conf.on
+    if args.on is not None:
+        on = [int(x) for x in args.on.split(",") if x]
+    sink_fns = [load_sink(name) for name in args.sinks or conf.sinks]
+    cursors = CursorStore(args.cursor) if args.cursor else None
+    if args.ledger:
+        setattr(Main, "ledger", Ledger(args.ledger, Main.scheduler))
+
+    Main.dispatcher.profile = args.profile
+    Main.coalescer.thresholds = tuple(conf.coalesce_thresholds)
+    if args.trace:
+        tracing.enable()
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1,
+                          lambda *_: logger.info("trace\n" + tracing.dump()))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        run(roots, sink_fns, on, conf.volume, args.backend, args.workers,
+            cursors, conf.queue_size, conf.queue_policy, stop)
+    except KeyboardInterrupt:
+        pass
+    if Main.ledger is not None:
+        Main.ledger.close()
+    logger.info(f"coalesce: {Main.coalescer.snapshot()}")
+    if args.trace:
+        logger.info("trace\n" + tracing.dump())
+    if args.profile:
+        logger.info("handlers\n" + Main.dispatcher.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""拾得物の台帳
+
+pushitemされたアイテムを時刻・数・NGSかどうかと共にSQLiteへ追記する。
+分・時・日毎の集計はその都度加算して保持するので、
+「この1週間の時間毎のメセタ」のような問い合わせに生の記録を走査せずに答えられる。
+"""
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 集計の単位と幅 (秒)
+SPANS = {"minute": 60, "hour": 3600, "day": 86400}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    ts INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    ngs INTEGER NOT NULL,
+    category TEXT,
+    seq INTEGER,
+    UNIQUE (ngs, category, seq, ts, item)
+);
+CREATE TABLE IF NOT EXISTS rollup (
+    span TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    ngs INTEGER NOT NULL,
+    num INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (span, item, bucket, ngs)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollup_bucket ON rollup (span, bucket);
+"""
+
+
+def bucket(ts, span):
+    """tsを含む区間の開始時刻 (日はローカル時刻の0時)"""
+    width = SPANS[span]
+    offset = time.localtime(ts).tm_gmtoff if span == "day" else 0
+    return ts - (ts + offset) % width
+
+
+class Ledger:
+    """SQLite (WALモード) の台帳
+
+    recordはメモリに溜めるだけで、interval秒毎にまとめて1つの
+    トランザクションで書き込む。schedulerを渡すとその上で書き込みを予約する。
+    渡さない場合は、件数がbatch_sizeに達した時とflush()の時に書き込む。
+
+    ログのカテゴリとsequenceを渡された記録は、同じものが既にあれば捨てる。
+    異常終了後にカーソルより前から読み直しても二重には数えない。
+    """
+
+    interval = 1.0
+    batch_size = 500
+
+    def __init__(self, path, scheduler=None):
+        self.path = path
+        self.scheduler = scheduler
+        self.pending = []
+        self.timer = None
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def record(self, ts, item, num, ngs=False, category=None, seq=None):
+        self.pending.append((ts, item, num, int(ngs), category, seq))
+        if self.scheduler is not None:
+            if self.timer is None:
+                self.timer = self.scheduler.call_later(
+                    self.interval, self.flush)
+        elif len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.timer = None
+        rows, self.pending = self.pending, []
+        if not rows:
+            return
+        sums = collections.defaultdict(lambda: [0, 0])
+        with self.lock, self.db:
+            added = 0
+            for row in rows:
+                cur = self.db.execute(
+                    "INSERT OR IGNORE INTO items"
+                    " (ts, item, num, ngs, category, seq)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", row)
+                if not cur.rowcount:
+                    continue  # 記録済み
+                added += 1
+                ts, item, num, ngs = row[:4]
+                for span in SPANS:
+                    acc = sums[span, bucket(ts, span), item, ngs]
+                    acc[0] += num
+                    acc[1] += 1
+            self.db.executemany(
+                "INSERT INTO rollup (span, bucket, item, ngs, num, count)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (span, item, bucket, ngs) DO UPDATE SET"
+                " num = num + excluded.num, count = count + excluded.count",
+                [key + tuple(acc) for key, acc in sums.items()])
+        logger.debug(f"ledger: {added}/{len(rows)} rows")
+
+    def close(self):
+        if self.timer is not None:
+            self.scheduler.cancel(self.timer)
+        self.flush()
+        with self.lock:
+            self.db.close()
+
+    def _query(self, sql, args):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def series(self, item, span="hour", since=0, until=None, ngs=None):
+        """itemの区間毎の合計 [(区間の開始時刻, 数)] を返す
+
+        sinceを含む区間からuntilを含む区間までを対象にする。
+        ngsを省略するとNGSと旧PSO2の分を合わせる。
+        """
+        sql = ("SELECT bucket, SUM(num) FROM rollup"
+               " WHERE span = ? AND item = ? AND bucket >= ?")
+        args = [span, item, bucket(since, span)]
+        if until is not None:
+            sql += " AND bucket <= ?"
+            args.append(bucket(until, span))
+        if ngs is not None:
+            sql += " AND ngs = ?"
+            args.append(int(ngs))
+        sql += " GROUP BY bucket ORDER BY bucket"
+        return self._query(sql, args)
+
+    def totals(self, since, until=None, span="day", item=None):
+        """期間中のアイテム毎の合計 {アイテム名: 数} を返す
+
+        期間の端はspanの区間単位に丸められる。
+        """
+        sql = "SELECT item, SUM(num) FROM rollup WHERE span = ? AND bucket >= ?"
+        args = [span, bucket(since, span)]
+        if until is not None:
+            sql += " AND bucket <= ?"
+            args.append(bucket(until, span))
+        if item is not None:
+            sql += " AND item = ?"
+            args.append(item)
+        sql += " GROUP BY item"
+        return dict(self._query(sql, args))
+
+    def today(self, item=None):
+        """今日 (ローカル時刻の0時から) のアイテム毎の合計"""
+        return self.totals(time.time(), item=item)
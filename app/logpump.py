@@ -1,19 +1,28 @@
-import csv
+import codecs
+import collections
+import concurrent.futures
+import fnmatch
 import functools
 import heapq
 import logging
+import os
 import re
 import threading
 import time
 from datetime import datetime
 from pathlib import Path
 
+from . import tracing, watcher
+
 logger = logging.getLogger(__name__)
 
 
 class Entry(list):
     """ログのエントリを表現するクラス"""
 
+    trace = None  # tracingが有効な時だけ各段階の時刻を持つ
+    logfile = None  # 読み取り元のLogFile
+
     def __init__(self, row: list, category: str, ngs: bool):
         super(Entry, self).__init__(row)
         if len(self) == 3:
@@ -69,21 +78,108 @@ def MyDocuments():
     return Path(buf.value)
 
 
+def split_records(text):
+    """PSO2ログのレコードをフィールドのリストにして順に返す
+
+    タブ区切り・ダブルクォート(csv.excel_tab相当)の方言を1パスで解釈する。
+    textは完結したレコードだけを含み、改行で終わっていること。
+    クォートを含まない行はsplitするだけで済ませる。
+    """
+    pos = 0
+    n = len(text)
+    while pos < n:
+        nl = text.find("\n", pos)
+        if nl < 0:
+            nl = n
+        if text.find('"', pos, nl) < 0:
+            end = nl - 1 if text[nl - 1:nl] == "\r" else nl
+            if end > pos:
+                yield text[pos:end].split("\t")
+            pos = nl + 1
+            continue
+
+        fields = []
+        while True:
+            if text.startswith('"', pos):
+                # クォートされたフィールド: 改行を含むことがある
+                parts = []
+                pos += 1
+                while True:
+                    q = text.find('"', pos)
+                    if q < 0:
+                        q = n
+                    parts.append(text[pos:q])
+                    pos = q + 1
+                    if not text.startswith('"', pos):
+                        break
+                    parts.append('"')  # "" は " 一文字
+                    pos += 1
+                nl = text.find("\n", pos)
+                if nl < 0:
+                    nl = n
+                # 閉じクォートの後ろはそのまま続ける
+                tab = text.find("\t", pos, nl)
+                end = nl if tab < 0 else tab
+                parts.append(text[pos:end].rstrip("\r"))
+                field = "".join(parts)
+            else:
+                tab = text.find("\t", pos, nl)
+                end = nl if tab < 0 else tab
+                field = text[pos:end].rstrip("\r") if tab < 0 \
+                    else text[pos:end]
+            fields.append(field)
+            pos = end + 1
+            if end == nl:
+                break
+        yield fields
+
+
 class LogFile:
     """
     ログファイルから未読部分を読み取る
+
+    ファイルはバイナリモードで開いたまま保持し、UTF-16の改行(b"\\n\\x00")を
+    バイト列のまま探して、完結したレコードだけをデコードする。
+    書きかけのレコードはbufに持ち越し、続きは次回のtailで読む。
     """
 
-    def __init__(self, path: Path, newfile=False):
+    NEWLINE = "\n".encode("utf-16-le")
+    QUOTE = '"'.encode("utf-16-le")
+
+    def __init__(self, path: Path, newfile=False, cursor=None):
+        """
+        cursor: CursorStoreから得た (pos, seq)。
+            posから読み直し、seq以前のエントリを読み飛ばす
+        """
         self.path = path
         self.category = self.cate(self.path.stem)
+        self.retired = False  # フォルダの一覧から外れた
+        self.woke = None  # 変化を検出した時刻 (tracing用)
+        self.traced = None  # 前回読み取った分の検出時刻 (tracing用)
+        self.fp = None
+        self.ino = None
+        self.buf = bytearray()  # pos以降の読み込み済みバイト列
+        self._reset_scan()
+        self.decoder = codecs.getincrementaldecoder("utf-16-le")("replace")
 
         # self.pos = 2 if newfile else self.path.stat().st_size  # 2=BOM
 
-        # st_sizeを信用せず、実際に読み進めてposを確定する
+        # st_sizeを信用せず、末尾から遡って最後のレコード境界にposを合わせる
         self.pos = 2  # 2=BOM
-        if not newfile:
-            self.tail()
+        self.resume_seq = None
+        self.last_seq = None  # 開いた時点で最後のレコードのsequence
+        if cursor is not None:
+            self.pos, self.resume_seq = cursor
+            self.last_seq = self.resume_seq
+        elif not newfile:
+            try:
+                self._seek_end()
+            except Exception as e:
+                logger.debug(f'{self.path.stem}: {e}')
+
+        # 配信待ちのtail結果 (開始位置, 終了位置, 最後のsequence)
+        self.batches = collections.deque()
+        self.delivered_pos = self.pos
 
         logger.debug(f'LogFile({self.path.stem}, {newfile}) pos={self.pos}')
 
@@ -91,148 +187,566 @@ class LogFile:
     def cate(stem):
         return re.match(r'(.+)(Log|_log)', stem).group(1)
 
-    class IncompleteLineError(Exception):
-        def __init__(self):
-            super().__init__('IncompleteLineError')
-
     def tail(self) -> list:
-        while True:
-            try:
-                return self._tail()
-            except (UnicodeError, self.IncompleteLineError) as e:
-                logger.debug(f'{self.path.stem}: {e}')
-                time.sleep(0.5)
-            except Exception as e:
-                logger.debug(f'{self.path.stem}: {e}')
-                return []
+        """完結したレコードをフィールドのリストにして返す
+
+        書きかけのレコードを待つことはない。
+        """
+        try:
+            return self._tail()
+        except Exception as e:
+            logger.debug(f'{self.path.stem}: {e}')
+            return []
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def _open(self):
+        self.fp = self.path.open("rb")
+        self.ino = os.fstat(self.fp.fileno()).st_ino
+
+    def _read(self):
+        if self.fp is None:
+            self._open()
+            self.fp.seek(self.pos + len(self.buf))
+        data = self.fp.read()
+        if data:
+            self.buf += data
+
+    def delivered(self, seq):
+        """seqまで配信済みとして、再開すべき位置を返す"""
+        batches = self.batches
+        while batches and batches[0][2] <= seq:
+            self.delivered_pos = batches.popleft()[1]
+        return batches[0][0] if batches else self.delivered_pos
+
+    def _find(self, sub, start, end):
+        """UTF-16の文字境界に一致するsubの位置を返す"""
+        buf = self.buf
+        i = buf.find(sub, start, end)
+        while i >= 0 and i % 2:
+            i = buf.find(sub, i + 1, end)
+        return i
+
+    def _reset_scan(self):
+        self.scanned = 0    # 改行を探し終えたbuf上の位置
+        self.quotes = 0     # scannedまでのクォートの数
+        self.complete = 0   # 完結しているレコードの終端
+
+    def _scan(self):
+        """buf先頭から完結しているレコードのバイト長を返す
+
+        前回の続きから走査するので、持ち越した部分を何度も数え直さない。
+        """
+        end = len(self.buf)
+        start = self.scanned
+        quotes = self.quotes
+        complete = self.complete
+        while start < end:
+            nl = self._find(self.NEWLINE, start, end)
+            if nl < 0:
+                break
+            q = self._find(self.QUOTE, start, nl)
+            while q >= 0:
+                quotes += 1
+                q = self._find(self.QUOTE, q + 2, nl)
+            start = nl + 2
+            if quotes % 2 == 0:
+                complete = start
+        self.scanned = start
+        self.quotes = quotes
+        self.complete = complete
+        return complete
+
+    def _consume(self, end):
+        """bufの先頭endバイトを読み取り済みにする"""
+        del self.buf[:end]
+        self.pos += end
+        self.scanned -= end
+        self.complete -= end
 
     def _tail(self) -> list:
-        ls = []
-        with self.path.open(encoding='utf-16-le', newline='') as f:
-            f.seek(self.pos, 0)
-            while True:
-                line = f.readline()
-                if not line:
-                    self.pos = f.tell()
-                    return ls
-                if not line.endswith('\n'):
-                    raise self.IncompleteLineError
-                ls.append(line)
-                while line.count('"') % 2 == 1:
-                    trail = f.readline()
-                    if not trail or not trail.endswith('\n'):
-                        raise self.IncompleteLineError
-                    ls.append(trail)
-                    line += trail
-
-
-def seqregurator(callback):
-    """callbackのsequence順を保障するwrapper"""
-
-    def flush(heap, expect):
-        drop = []
-        while heap:
-            entry = heapq.heappop(heap)
-            callback(entry)
-            drop += list(range(expect, entry.sequence))
-            expect = entry.sequence + 1
-        if drop:
-            drop = ','.join(map(str, drop))
-            logger.warning(f'Drop {drop}')
-        return expect
-
-    def main():
-        heap = []
-        expect = None
-        while True:
-            entry = yield
-
-            if expect is None or entry.sequence < expect:
-                if expect is not None:
-                    logger.info(f'sequense restart ({entry.sequence})')
-                    flush(heap, expect)
-                expect = entry.sequence
+        self._read()
+        end = self._scan()
+        if not end:
+            return []
+
+        with memoryview(self.buf) as view:
+            text = self.decoder.decode(view[:end])
+        self._consume(end)
+        return list(split_records(text))
+
+    BLOCK = 64 * 1024
+
+    # 行頭のタイムスタンプ "YYYY-MM-DDTHH:MM:SS\t" (UTF-16-LE)
+    _header = re.compile(b"".join(
+        re.escape(c.encode("utf-16-le")) if c != "0" else rb"\d\x00"
+        for c in "\n0000-00-00T00:00:00\t"))
+
+    @classmethod
+    def _quotes(cls, data, start, end, base):
+        """data[start:end]にあるクォートの数 (baseはdataのファイル上の位置)"""
+        n = 0
+        i = data.find(cls.QUOTE, start, end)
+        while i >= 0:
+            if (base + i) % 2 == 0:
+                n += 1
+            i = data.find(cls.QUOTE, i + 1, end)
+        return n
+
+    def _seek_end(self):
+        """末尾から固定長ブロックで遡り、最後のレコード境界を探す
+
+        ファイルの大きさによらず、読むのは末尾付近のブロックだけで済む。
+        複数行メッセージの中にレコード先頭に見える行が含まれることがあるため、
+        候補の先頭から_scanでクォートを数え、末尾まで完結する最も新しい候補を採る。
+        ただし、その候補から末尾までクォートが無く、最も古い候補から数えて
+        クォートが閉じていない位置にある場合は、書きかけのメッセージの中の行とみなし、
+        最も古い候補から数えてクォートの閉じている最も新しい候補を採る。
+        """
+        self._open()
+        size = self.fp.seek(0, 2)
+        if size <= 2:
+            self.fp.seek(2)
+            return
+        lo = size
+        data = b""
+        starts = []
+        while not starts and lo > 2:
+            block = min(self.BLOCK, lo - 2)
+            lo -= block
+            self.fp.seek(lo)
+            data = self.fp.read(block) + data
+            starts = [
+                m.start() + 2
+                for m in self._header.finditer(data)
+                if (lo + m.start()) % 2 == 0
+            ]
+        if not starts:
+            starts = [0]  # ファイル先頭のレコード
+        self.fp.seek(lo + len(data))
+
+        for start in reversed(starts):
+            self.buf = bytearray(data[start:])
+            self._reset_scan()
+            end = self._scan()
+            if end == len(self.buf):
+                break
+        else:
+            # 書きかけのレコードがある
+            start = starts[-1]
+            self.buf = bytearray(data[start:])
+            self._reset_scan()
+            end = self._scan()
+
+        anchor = starts[0]
+        if self._quotes(data, anchor, start, lo) % 2 \
+                and not self._quotes(data, start, len(data), lo):
+            start = max(
+                s for s in starts
+                if self._quotes(data, anchor, s, lo) % 2 == 0)
+            self.buf = bytearray(data[start:])
+            self._reset_scan()
+            end = self._scan()
+
+        self.pos = lo + start
+        if end:
+            text = bytes(self.buf[:end]).decode("utf-16-le", "replace")
+            for row in split_records(text):
+                if len(row) > 1 and row[1].isdigit():
+                    self.last_seq = int(row[1])
+        self._consume(end)
+
+
+class ReorderBuffer:
+    """callbackのsequence順をカテゴリ毎に保障する
+
+    カテゴリ(ログファイル)毎に独立したsequenceを持つので、それぞれ別のヒープで
+    並べ替える。欠番を待つのは、保留中で最も古いエントリのtimestampが
+    最新のtimestampよりtimeout秒以上古くなるまで。
+    statsには欠番待ち(gap)・欠番(drop)・再開(restart)・打ち切り(timeout)を数える。
+    """
 
-            heapq.heappush(heap, entry)
-            while heap and heap[0].sequence == expect:
-                entry = heapq.heappop(heap)
-                callback(entry)
-                expect += 1
+    timeout = 3
 
-            if heap:
-                pend = ','.join(map(str, sorted([x.sequence for x in heap])))
-                logger.debug(f"expect:{expect} pend:{pend}")
-                ts = [x.timestamp for x in heap]
-                if (max(ts) - min(ts)) > 3:
-                    expect = flush(heap, expect)
+    class Stream:
+        def __init__(self):
+            self.heap = []     # 保留中のエントリ (sequence順)
+            self.tsheap = []   # (timestamp, sequence) 配信済みは遅延削除
+            self.expect = None
+            self.newest = 0
+
+    def __init__(self, callback, timeout=None):
+        self.callback = callback
+        if timeout is not None:
+            self.timeout = timeout
+        self.streams = {}
+        self.stats = collections.Counter()
+
+    def __call__(self, entry):
+        st = self.streams.get(entry.category)
+        if st is None:
+            st = self.streams[entry.category] = self.Stream()
+
+        if st.expect is None or entry.sequence < st.expect:
+            if st.expect is not None:
+                logger.info(f'{entry.category}: sequence restart'
+                            f' ({entry.sequence})')
+                self.stats["restart"] += 1
+                self.flush(st)
+            st.expect = entry.sequence
+
+        st.newest = max(st.newest, entry.timestamp)
+
+        if entry.sequence == st.expect and not st.heap:
+            # 順番通り (ほとんどの場合)
+            st.expect += 1
+            self.callback(entry)
+            return
+
+        heapq.heappush(st.heap, entry)
+        heapq.heappush(st.tsheap, (entry.timestamp, entry.sequence))
+        self._release(st)
+
+        if st.heap:
+            self.stats["gap"] += 1
+            tsheap = st.tsheap
+            while tsheap[0][1] < st.expect:
+                heapq.heappop(tsheap)
+            if st.newest - tsheap[0][0] > self.timeout:
+                self.stats["timeout"] += 1
+                self.flush(st)
+
+    def _release(self, st):
+        heap = st.heap
+        while heap and heap[0].sequence == st.expect:
+            entry = heapq.heappop(heap)
+            st.expect += 1
+            self.callback(entry)
 
-    coro = main()
-    next(coro)
-    return coro.send
+    def flush(self, st):
+        """欠番を諦めて保留中のエントリを全て配信する"""
+        heap = st.heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry.sequence > st.expect:
+                drop = entry.sequence - st.expect
+                self.stats["drop"] += drop
+                logger.warning(f'{entry.category}: drop {drop}'
+                               f' before {entry.sequence}')
+            st.expect = entry.sequence + 1
+            self.callback(entry)
+        st.tsheap.clear()
 
 
 class LogFolder:
-    def __init__(self, path: Path, callback):
+    def __init__(self, path: Path, callback, cursors=None, lock=None):
+        """
+        lock: 配信(callback)を直列化するロック。複数のフォルダで共有する
+        """
         logger.debug(f'LogFolder({str(path)})')
         self.path = path
-        self.callback = seqregurator(callback)
-        self.logfiles = {
-            path: LogFile(path)
-            for path in self.logs()
-        }
+        self.lock = threading.Lock() if lock is None else lock
+        self._callback = callback
+        self.callback = ReorderBuffer(self._deliver)
+        self.cursors = cursors
+        self.mtime = None
+        self.index = {}  # カテゴリ -> 最新のログファイル
+        self.retired = []  # 一覧から外れ、最後の読み取りを待つLogFile
+        self.logfiles = {path: self._open(path) for path in self.logs()}
         self.ngs = "ngs" in path.stem
         self.known = set(self.logfiles.keys())
 
-    def logs(self):
-        logs = list(filter(
-            lambda path: path.stem != "pso2dynamicdownloader_log",
-            self.path.glob("*Log*.txt")))
-
-        def newestof(cate):
-            logs_cate = filter(lambda x: x.stem.startswith(cate), logs)
-            return max(logs_cate)
-
-        categories = {LogFile.cate(x.stem) for x in logs}
+    def _open(self, path):
+        """起動時に見つけたログファイルを開く
+
+        カーソルがあればその位置から読み直す。無くても、同じカテゴリの
+        古いファイルのカーソルがあれば停止中に作られたファイルなので先頭から読み、
+        古いファイルの書き足された残りも先に読む。
+        どちらも無ければ末尾から読む。
+        """
+        if self.cursors is None:
+            return LogFile(path)
+        cursor = self.cursors.get(path, path.stat())
+        if cursor is not None:
+            return self._save(LogFile(path, cursor=cursor))
+        category = LogFile.cate(path.stem)
+        older = [
+            old for old in self.cursors.paths()
+            if old.parent == path.parent and old < path
+            and LogFile.cate(old.stem) == category]
+        if not older:
+            return self._save(LogFile(path))
+        for old in older:
+            try:
+                cursor = self.cursors.get(old, old.stat())
+            except FileNotFoundError:
+                continue
+            if cursor is not None:
+                log = LogFile(old, cursor=cursor)
+                log.retired = True
+                self.retired.append(log)
+        logger.info(f'{path.name}: created while stopped, read from start')
+        return self._save(LogFile(path, True))
+
+    def _save(self, log):
+        """開いた時点の位置をカーソルに記録してlogを返す
+
+        このまま何も配信せずに終了しても、次回はここから読み直せる。
+        """
+        if self.cursors is None:
+            return log
+        try:
+            ino = log.path.stat().st_ino
+        except FileNotFoundError:
+            return log
+        self.cursors.update(log.path, ino, log.pos, log.pos, log.last_seq)
+        return log
+
+    def _deliver(self, entry):
+        if entry.trace is not None:
+            tracing.mark(entry.trace, "released")
+        self._callback(entry)
+        if self.cursors is None:
+            return
+        log = entry.logfile
+        if log is None or log.ino is None or log.retired:
+            return
+        pos = log.delivered(entry.sequence)
+        self.cursors.update(
+            log.path, log.ino, log.pos, pos, entry.sequence)
+
+    def logs(self, refresh=False):
+        """カテゴリ毎の最新のログファイルのsetを返す
+
+        一覧はフォルダの更新時刻が変わった時かrefresh指定時だけ取り直す。
+        """
+        mtime = self.path.stat().st_mtime_ns
+        if refresh or mtime != self.mtime:
+            self.mtime = mtime
+            self.index = self._listdir()
+        return set(self.index.values())
+
+    def _listdir(self):
+        index = {}
+        with os.scandir(self.path) as it:
+            for de in it:
+                if not fnmatch.fnmatch(de.name, "*Log*.txt"):
+                    continue
+                stem = de.name[:-4]
+                if stem == "pso2dynamicdownloader_log":
+                    continue
+                path = self.path.joinpath(de.name)
+                cate = LogFile.cate(stem)
+                if cate not in index or index[cate] < path:
+                    index[cate] = path
+        return index
+
+    def retire(self):
+        """一覧から外れたLogFileを返す
+
+        書き足された分が残っているかもしれないので、呼び出し側は
+        新しいファイルより先に最後の読み取りをしてからcloseする。
+        """
+        retired, self.retired = self.retired, []
+        return retired
+
+    def targets(self, changed=None):
+        """読み取るべきLogFileのリストを返す
+
+        changedは監視が報告した変化のあったファイルのset。
+        Noneなら全てのファイルを確認する。
+        """
+        if changed is not None:
+            changed = {x for x in changed if x.parent == self.path}
+            if not changed:
+                return []
 
-        return {newestof(cate) for cate in categories}
+        with self.lock:
+            # 監視が知らないファイルを報告したら一覧を取り直す
+            self._update(changed is not None and not changed <= self.known)
+
+        return [
+            log for path, log in self.logfiles.items()
+            if changed is None or path in changed
+        ]
+
+    def read(self, log):
+        """logの未読部分を読み取ってcallbackへ渡す
+
+        読み取りはロックの外で行い、配信だけをロックで直列化する。
+        """
+        start = log.pos
+        rows = log.tail()
+        written = None
+        if tracing.enabled and rows:
+            detected = log.woke or time.perf_counter()
+            written = self._written(log, len(rows), detected)
+        entries = []
+        for i, row in enumerate(rows):
+            entry = Entry(row, log.category, self.ngs)
+            entry.logfile = log
+            if written is not None:
+                entry.trace = tracing.start(written[i], detected)
+                tracing.mark(entry.trace, "parsed")
+            if log.resume_seq is not None:
+                # 前回配信済みの範囲を読み飛ばす
+                if entry.sequence <= log.resume_seq:
+                    continue
+                log.resume_seq = None
+            entries.append(entry)
+        if not entries:
+            return
+        with self.lock:
+            if self.cursors is not None and not log.retired:
+                log.batches.append((start, log.pos, entries[-1].sequence))
+            for entry in entries:
+                self.callback(entry)
 
-    def scan(self):
-        now = self.logs()
+    @staticmethod
+    def _written(log, n, detected):
+        """n件のレコードが書き込まれた時刻の推定値のリスト
+
+        ファイルの更新時刻は最後の書き込みの時刻なので、前回読み取った時点
+        (前回の更新時刻と検出時刻の遅い方) から今回の更新時刻までの間に
+        等間隔で書き込まれたものとみなす。
+        """
+        end = min(detected, tracing.wall2perf(os.stat(log.path).st_mtime_ns))
+        begin = end if log.traced is None else min(end, log.traced)
+        log.traced = max(end, detected)
+        step = (end - begin) / n
+        return [end - step * (n - 1 - i) for i in range(n)]
+
+    def _update(self, refresh=False):
+        now = self.logs(refresh)
 
         for path in (now - self.known):
-            self.logfiles[path] = LogFile(path, True)
+            log = self._save(LogFile(path, True))
+            self.logfiles[path] = log
             self.known.add(path)
 
-        for log in self.logfiles.values():
-            for row in csv.reader(log.tail(), dialect=csv.excel_tab):
-                entry = Entry(row, log.category, self.ngs)
-                self.callback(entry)
-
         for path in (self.known - now):
-            del self.logfiles[path]
+            log = self.logfiles.pop(path)
+            log.retired = True
+            self.retired.append(log)
             self.known.discard(path)
             logger.debug('removed ' + str(path))
 
+    def close(self):
+        for log in list(self.logfiles.values()) + self.retire():
+            log.close()
+
+
+def default_folders():
+    sega = MyDocuments().joinpath("SEGA")
+    return [
+        sega.joinpath('PHANTASYSTARONLINE2/log'),
+        sega.joinpath('PHANTASYSTARONLINE2/log_ngs'),
+    ]
+
 
 class LogPump:
-    def __init__(self, callback):
-        sega = MyDocuments().joinpath("SEGA")
+    workers = 4
+
+    def __init__(self, callback, folders=None, backend=None, cursors=None,
+                 workers=None):
+        """
+        folders: 監視するログフォルダ (省略時はマイドキュメント下のPSO2)
+        backend: "inotify" | "polling" (省略時は自動選択)
+        cursors: CursorStore 前回終了時の位置から読み直す
+        workers: ログファイルを並行して読み取るスレッド数
+        """
+        if folders is None:
+            folders = default_folders()
+        folders = [path for path in map(Path, folders) if path.is_dir()]
+        # 読み取り位置を確定する前から監視を始め、取りこぼしを防ぐ
+        self.watcher = watcher.create(folders, backend)
+        self.cursors = cursors
+        self.lock = threading.Lock()
         self.folderz = {
-            path: LogFolder(path, callback)
-            for path in map(
-                lambda subpath: sega.joinpath(subpath), [
-                    'PHANTASYSTARONLINE2/log',
-                    'PHANTASYSTARONLINE2/log_ngs',
-                ])
-            if path.is_dir()
+            path: LogFolder(path, callback, cursors, self.lock)
+            for path in folders
         }
+        if workers is not None:
+            self.workers = workers
+        self.busy = set()    # 読み取り中のLogFile
+        self.again = set()   # 読み取り中に再度変化があったLogFile
+        self.busy_lock = threading.Lock()
+        self.idle = threading.Condition(self.busy_lock)  # busyが減った
+        if cursors is not None:
+            cursors.forget(set().union(
+                *(folder.known for folder in self.folderz.values())))
         self.th = threading.Thread(target=self._main, daemon=True)
 
     def _main(self):
+        executor = concurrent.futures.ThreadPoolExecutor(
+            self.workers, thread_name_prefix="LogPump")
+        # 停止中に書かれた分を読み取る
+        changed = None
         while self.keep_running:
+            woke = time.perf_counter()
             for folder in self.folderz.values():
-                folder.scan()
-            time.sleep(0.5)
+                logs = folder.targets(changed)
+                for log in folder.retire():
+                    self._retire(folder, log)
+                for log in logs:
+                    log.woke = woke
+                    self._submit(executor, folder, log)
+            if self.cursors is not None:
+                with self.lock:
+                    self.cursors.flush_if_due()
+            changed = self.watcher.wait(0.5)
+        executor.shutdown()
+        self.watcher.close()
+        for folder in self.folderz.values():
+            folder.close()
+        if self.cursors is not None:
+            self.cursors.flush()
+
+    def _submit(self, executor, folder, log):
+        """ファイル毎に同時に一つだけ読み取りを走らせる"""
+        with self.busy_lock:
+            if log in self.busy:
+                self.again.add(log)
+                return
+            self.busy.add(log)
+        executor.submit(self._read, folder, log)
+
+    def _retire(self, folder, log):
+        """一覧から外れたファイルの残りを読み取ってから閉じる
+
+        ワーカーが読み取り中なら終わるのを待つ。一覧から外れたので
+        以後このファイルの読み取りが投入されることは無い。
+        """
+        with self.idle:
+            self.again.discard(log)
+            self.idle.wait_for(lambda: log not in self.busy)
+        try:
+            folder.read(log)
+        except Exception as e:
+            logger.error(f'{log.path.stem}: {e}')
+        log.close()
+
+    def _read(self, folder, log):
+        while True:
+            try:
+                folder.read(log)
+            except Exception as e:
+                logger.error(f'{log.path.stem}: {e}')
+            with self.busy_lock:
+                if log not in self.again:
+                    self.busy.discard(log)
+                    self.idle.notify_all()
+                    return
+                self.again.discard(log)
+
+    def stats(self):
+        """並べ替えの統計 (gap, drop, restart, timeout)"""
+        return sum(
+            (folder.callback.stats for folder in self.folderz.values()),
+            collections.Counter())
 
     def start(self):
         self.keep_running = True
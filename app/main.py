@@ -1,11 +1,29 @@
+import functools
 import random
 import re
 
-from . import bouyomichan, chatcmd, misc
-from .playsound import playsound
+from . import bouyomichan, chatcmd, coalesce, misc, tracing
+
+try:
+    from .playsound import playsound
+except ImportError:  # winmmが無い(Windows以外)
+    def playsound(sound, volume=1.0):
+        pass
 
 REPORT_ITEM_MAX = 10
 
+# 読み上げの優先度 (小さいほど先に読む。bouyomichan.Senderを参照)
+PRIO_WARNING = 0
+PRIO_WHISPER = 1  # ささやき・パーティー・チーム等、公開チャット以外の発言
+PRIO_ITEM = 2
+PRIO_CHAT = 3
+
+# 古くなって捨てた分は件数だけ読み上げる (優先度: 書式)
+TALK_SUMMARIES = {
+    PRIO_ITEM: "アイテムの読み上げ{n}件を省略",
+    PRIO_CHAT: "チャット{n}件を省略",
+}
+
 casinocounter = misc.CasinoCounter()
 
 spitem = misc.UsersFile(
@@ -78,9 +96,15 @@ item_name_replacer = {
 }
 
 
-def pushitem(item, num):
+ledger = None  # 設定されていれば拾得物を記録する (ledger.Ledger)
+
+
+def pushitem(item, num, ent=None):
     item = item_name_replacer.get(item, item)
     add_inventory(item, num)
+    if ledger is not None and ent is not None:
+        ledger.record(ent.timestamp, item, num, ent.ngs,
+                      ent.category, ent.sequence)
     reporter.put(item, num)
     spitem_check_and_notify(item)
 
@@ -98,39 +122,50 @@ def report_handler(counter: misc.ItemCounter):
             if n > REPORT_ITEM_MAX:
                 names = names[:REPORT_ITEM_MAX] + \
                     [f"残り{n - REPORT_ITEM_MAX}件省略"]
-        talk(" ".join(names))
+        talk(" ".join(names), priority=PRIO_ITEM)
 
 
-reporter = misc.DelayedReporter(report_handler)
+scheduler = misc.Scheduler()
+reporter = misc.DelayedReporter(report_handler, scheduler)
 
 
 def spitem_check_and_notify(item):
-    dic = spitem()
-
-    if item in dic:
-        sound = dic[item]
-        if get_config(105):
-            talk(item)
-        if get_config(300):
-            play_sound(sound)
+    sound = spitem().lookup(item)
+    if sound is None:
         return
-
-    for pattern, sound in dic.rex:
-        if pattern.match(item):
-            if get_config(105):
-                talk(item)
-            if get_config(300):
-                play_sound(sound)
-            return
+    if get_config(105):
+        talk(item, priority=PRIO_ITEM)
+    if get_config(300):
+        play_sound(sound)
 
 
 talkactive = misc.TalkativesDetector()
 talkactive_sound = misc.TalkativesDetector()
 
 
-def talk(text, guard_time=60):
+def _send_talk(text, **kwargs):
+    if not hasattr(bouyomichan.talk, "sender"):
+        bouyomichan.talk.sender = bouyomichan.Sender(
+            summaries=TALK_SUMMARIES)
+    bouyomichan.talk(text, **kwargs)
+
+
+coalescer = coalesce.Coalescer(
+    _send_talk, scheduler, bouyomichan.backlog, min_priority=PRIO_CHAT)
+
+
+def talk(text, guard_time=60, priority=PRIO_CHAT, kind=None, name=None):
+    """textを読み上げる
+
+    kindとnameを渡すと、読み上げが滞っている時に同じ種類の文とまとめられる
+    (coalesce.Coalescerを参照)。
+    """
     if not talkactive(text, guard_time):
-        bouyomichan.talk(text)
+        kwargs = {"priority": priority}
+        if _trace is not None:
+            kwargs["on_sent"] = functools.partial(
+                tracing.mark, _trace, "sent")
+        coalescer.put(text, kind, name, **kwargs)
 
 
 def play_sound(sound, guard_time=1):
@@ -142,35 +177,40 @@ def play_sound(sound, guard_time=1):
 ##############################################################################
 
 
+dispatcher = misc.Dispatcher()
+
+
+@dispatcher.handler("Chat")
 def handle_Chat(ent):
     time, seq, channel, id, name, mess = ent[:6]
+    tok = chatcmd.tokenize(mess)
+    prio = PRIO_CHAT if channel == "PUBLIC" else PRIO_WHISPER
 
-    match = re.search(r'/[cmf]?la +([^ ]+)', mess)
-    if match:
-        cmd = match.group(1)
+    cmd = tok.arg("la")
+    if cmd is not None:
         dic = la_dict()
         if cmd in dic:
             la = dic[cmd]
             if get_config(102):
                 la_name = re.sub(r'^\d+', '', la.name)  # 番号を除く
-                talk(f'{name}が{la_name}した')
+                talk(f'{name}が{la_name}した', priority=prio,
+                     kind="la", name=name)
             if get_config(203) and "Reaction" in la.note:
                 clipboard("/la reaction")
 
-    equip = re.search(
-        r'/(skillring|sr|costume|cs|camouflage|cmf) +([^ ]+)', mess)
-    if equip and get_config(103):
-        talk(f'{name}が{equip.group(2)}を装備した')
+    equip = tok.arg("equip")
+    if equip is not None and get_config(103):
+        talk(f'{name}が{equip}を装備した', priority=prio,
+             kind="equip", name=name)
         return
 
-    stamp = re.search(r'/stamp +[^ ]+', mess)
-    if stamp and get_config(105):
-        talk(f'{name}のスタンプ')
+    if tok.arg("stamp") is not None and get_config(105):
+        talk(f'{name}のスタンプ', priority=prio, kind="stamp", name=name)
         return
 
-    txt = chatcmd.strip(mess)
+    txt = tok.text
     if txt:
-        talk(f'{name}「{txt}」')
+        talk(f'{name}「{txt}」', priority=prio, kind="chat", name=name)
 
     if "la" in locals():
         la_add(cmd)
@@ -179,29 +219,33 @@ def handle_Chat(ent):
     chat_print(ent, mess)
 
 
+@dispatcher.handler("SymbolChat")
 def handle_SymbolChat(ent):
     time, seq, channel, id, name, said = ent[:6]
     chat_print(ent, said)
     if get_config(104):
-        talk(f'{name}のシンボルアート')
+        talk(f'{name}のシンボルアート', kind="symbol", name=name)
 
 
+@dispatcher.handler("Reward")
 def handle_Reward(ent):
     item, num = ent[-2], ent.Num
     if item.endswith('スタージェム'):
         # handle_StarGemで数えるのでここでは除外
         return
-    pushitem(item, num)
+    pushitem(item, num, ent)
     if get_config(200):
         clipboard(item)
 
 
+@dispatcher.handler("StarGem")
 def handle_StarGem(ent):
     num = int(ent[-3])
     if num > 0:
-        pushitem("スタージェム", num)
+        pushitem("スタージェム", num, ent)
 
 
+@dispatcher.handler("Action")
 def handle_Action(ent):
     act, item, num, meseta = ent[2], ent[5], ent.Num, ent.Meseta
     num = 1 if num is None else num
@@ -215,30 +259,38 @@ def handle_Action(ent):
     if get_config(301) and act.startswith('[Pickup-ToWarehouse'):
         guard_time = 15
         play_sound("emergency-alert1.mp3", guard_time)
-        talk("警告！アイテムパックが満杯です！", guard_time)
+        talk("警告！アイテムパックが満杯です！", guard_time, PRIO_WARNING)
 
     if act.startswith('[Pickup') and meseta is None:
-        pushitem(item, num)
+        pushitem(item, num, ent)
 
     if meseta:
-        pushitem('N-メセタ' if ent.ngs else 'メセタ', meseta)
+        pushitem('N-メセタ' if ent.ngs else 'メセタ', meseta, ent)
 
 
+@dispatcher.handler("Craft")
 def handle_Craft(ent):
     act, item, num = ent[2], ent[5], ent.Num
     if 'Material' in act and num is not None:
-        pushitem(item, num)
+        pushitem(item, num, ent)
 
 
+@dispatcher.handler("Scratch")
 def handle_Scratch(ent):
     if 'Received' in ent[3]:
         item, num = ent[6], ent.Num
-        pushitem(item, num)
+        pushitem(item, num, ent)
+
+
+_trace = None  # 処理中のエントリのtrace
 
 
 def on_entry(ent):
-    g = globals()
-    name = 'handle_' + ent.category
-    if name in g:
-        fn = g[name]
-        fn(ent)
+    global _trace
+    if ent.trace is not None:
+        tracing.mark(ent.trace, "dispatched")
+        _trace = ent.trace
+    try:
+        dispatcher(ent)
+    finally:
+        _trace = None
@@ -1,11 +1,13 @@
 import collections
 import csv
+import functools
 import heapq
 import io
+import itertools
 import logging
 import pathlib
 import re
-import statistics
+import threading
 import time
 import urllib.request
 
@@ -13,30 +15,88 @@ logger = logging.getLogger(__name__)
 
 
 class UsersFile:
+    """利用者が編集するファイルの内容
+
+    最初の呼び出しで読み込み、以後は別スレッドで変更を監視して読み直す。
+    呼び出しは保持している内容を返すだけで、ファイルには触れない。
+    変更を見つけても、更新時刻とサイズがinterval秒変わらなくなるまで待ち、
+    読み込み中に変わった場合や読み込みに失敗した場合は前の内容を使い続ける。
+    """
+
     data = None
+    interval = 1.0
 
     def __init__(self, filename, loader, loader2=None):
-        self.mtime = 0
+        self.sig = None  # 読み込んだ時の (更新時刻, サイズ)
         self.path = pathlib.Path(filename)
         self.loader = loader
         self.loader2 = loader2
+        self.thread = None
+        self.lock = threading.Lock()
 
     def __call__(self):
-        try:
-            t = self.path.stat().st_mtime
-            if self.mtime < t:
-                self.data = self.loader(self.path)
-                self.mtime = t
-        except FileNotFoundError:
+        if self.thread is None:
+            self._start()
+        return self.data
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            sig = self._stat()
+            if sig is not None:
+                self._load(sig)
             if self.data is None and self.loader2 is not None:
                 self.data = self.loader2()
-        return self.data
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+
+    def _stat(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, sig):
+        try:
+            data = self.loader(self.path)
+        except Exception as e:
+            logger.warning(f"{self.path}: {e}")
+            return
+        if self._stat() != sig:
+            return  # 読み込み中に書き換えられた
+        self.data = data
+        self.sig = sig
+
+    def _watch(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            sig = self._stat()
+            if sig is None or sig == self.sig:
+                pending = None
+            elif sig != pending:
+                pending = sig  # 書き込みが落ち着くのを待つ
+            else:
+                self._load(sig)
+                pending = None
 
 
 class SpItem(dict):
+    """spitem.txtの内容 (アイテム名 -> サウンド)
+
+    正規表現のルールは記述順に1つの正規表現へまとめて照合する。
+    照合結果はアイテム名毎にキャッシュし、ファイルを読み直せば捨てられる。
+    """
+
+    cache_size = 4096
+
     def __init__(self):
-        self.rex = set()
+        self.rex = []
         self.sounds = set()
+        self.combined = None
+        self.lookup = functools.lru_cache(self.cache_size)(self._lookup)
 
     @classmethod
     def load(cls, path):
@@ -53,12 +113,39 @@ class SpItem(dict):
                     continue
                 if line.startswith("/") and line.endswith("/"):
                     pattern = re.compile(line[1:-1])
-                    self.rex.add((pattern, current_audio))
+                    self.rex.append((pattern, current_audio))
                     continue
                 self[line] = current_audio
+        self._compile()
         logger.info(str(path) + " loaded")
         return self
 
+    def _compile(self):
+        # 後方参照は番号がずれるので、まとめずに1つずつ照合する
+        if any(re.search(r"\\\d|\(\?P=", p.pattern) for p, _ in self.rex):
+            return
+        try:
+            self.combined = re.compile("|".join(
+                f"(?:{p.pattern})(?P<_spitem{i}>)"
+                for i, (p, _) in enumerate(self.rex)))
+        except re.error as e:
+            logger.warning(e)
+
+    def _lookup(self, item):
+        if item in self:
+            return self[item]
+        if not self.rex:
+            return None
+        if self.combined is not None:
+            m = self.combined.match(item)
+            if m is None:
+                return None
+            return self.rex[int(m.lastgroup[7:])][1]
+        for pattern, sound in self.rex:
+            if pattern.match(item):
+                return sound
+        return None
+
 
 def la_dict_loader(path):
     with path.open(encoding='utf-8') as f:
@@ -116,28 +203,124 @@ def load_la_dict_online():
 
 
 class TalkativesDetector:
-    """おしゃべり過多検出器"""
+    """おしゃべり過多検出器
 
-    def __init__(self):
-        self.heap = []
+    期間毎の期限順キューと、text毎の出現数の表を持つ。
+    確認も期限切れの削除も、償却で1件あたりO(1)で済む。
+    覚えておく件数はmaxlenまでで、溢れたら期限の近いものから忘れる。
+    """
+
+    maxlen = 10000
+
+    def __init__(self, maxlen=None):
+        if maxlen is not None:
+            self.maxlen = maxlen
+        self.queues = {}  # period -> deque[(期限, text)]
+        self.counts = {}  # text -> 期間内の出現数
+        self.size = 0
+
+    def __len__(self):
+        return self.size
 
     def __call__(self, text, period=60):
         """一定期間内に同じtextがあればTrueを返す"""
-        now = time.time()
+        now = time.monotonic()
         self.forget(now)
-        exists = any(map(lambda x: x[1] == text, self.heap))
-        heapq.heappush(self.heap, (now + period, text))
+        counts = self.counts
+        exists = text in counts
+        counts[text] = counts.get(text, 0) + 1
+        queue = self.queues.get(period)
+        if queue is None:
+            queue = self.queues[period] = collections.deque()
+        queue.append((now + period, text))
+        self.size += 1
+        while self.size > self.maxlen:
+            self._pop(min((q for q in self.queues.values() if q),
+                          key=lambda q: q[0][0]))
         return exists
 
     def forget(self, expiry):
-        heap = self.heap
-        while heap and heap[0][0] < expiry:
-            heapq.heappop(heap)
+        for period, queue in list(self.queues.items()):
+            while queue and queue[0][0] < expiry:
+                self._pop(queue)
+            if not queue:
+                del self.queues[period]
+
+    def _pop(self, queue):
+        _, text = queue.popleft()
+        self.size -= 1
+        n = self.counts[text] - 1
+        if n:
+            self.counts[text] = n
+        else:
+            del self.counts[text]
+
+
+class Dispatcher:
+    """カテゴリ毎のハンドラ表
+
+    1つのカテゴリに複数のハンドラを登録でき、登録順に呼ぶ。
+    ハンドラの無いカテゴリは辞書を1回引くだけで終わる。
+    profileをTrueにするとハンドラ毎の呼び出し回数と所要時間を数える。
+    """
+
+    def __init__(self):
+        self.table = {}
+        self.profile = False
+        self.stats = collections.defaultdict(lambda: [0, 0.0])
+
+    def register(self, category, fn):
+        self.table[category] = self.table.get(category, ()) + (fn,)
+        return fn
+
+    def unregister(self, category, fn):
+        handlers = tuple(x for x in self.table.get(category, ()) if x != fn)
+        if handlers:
+            self.table[category] = handlers
+        else:
+            self.table.pop(category, None)
+
+    def handler(self, category):
+        """ハンドラを登録するデコレータ"""
+        return lambda fn: self.register(category, fn)
+
+    def __call__(self, ent):
+        handlers = self.table.get(ent.category)
+        if handlers is None:
+            return
+        if not self.profile:
+            for fn in handlers:
+                fn(ent)
+            return
+        for fn in handlers:
+            t = time.perf_counter()
+            try:
+                fn(ent)
+            finally:
+                st = self.stats[fn.__qualname__]
+                st[0] += 1
+                st[1] += time.perf_counter() - t
+
+    def report(self):
+        """ハンドラ毎の呼び出し回数と所要時間を文字列で返す"""
+        lines = []
+        for name, (calls, secs) in sorted(
+                self.stats.items(), key=lambda x: -x[1][1]):
+            lines.append(f"{name:24} {calls:8} calls {secs * 1000:10.1f}ms"
+                         f" {secs * 1e6 / calls:8.1f}us/call")
+        return "\n".join(lines)
 
 
 class CasinoCounter:
+    """カジノの遊戯成績
+
+    当選率は直近window回の当否の合計を保持して求める。
+    """
+
+    window = 30
+
     def __init__(self):
-        self.deq = collections.deque(maxlen=30)
+        self.deq = collections.deque(maxlen=self.window)
         self.reset()
 
     def reset(self):
@@ -148,12 +331,18 @@ class CasinoCounter:
         self.defeats = 0
         self.defeats_max = 0
         self.deq.clear()
+        self.window_hits = 0
 
     def update(self, bet, ret):
         self.count += 1
         self.bet += bet
         self.ret += ret
-        self.deq.append(min(1, ret))
+        hit = min(1, ret)
+        deq = self.deq
+        if len(deq) == deq.maxlen:
+            self.window_hits -= deq[0]
+        deq.append(hit)
+        self.window_hits += hit
         if ret == 0:
             self.defeats += 1
             self.defeats_max = max(self.defeats_max, self.defeats)
@@ -172,7 +361,7 @@ class CasinoCounter:
         if self.count == 0:
             return 0
         # return self.hit / self.count
-        return statistics.mean(self.deq)
+        return self.window_hits / len(self.deq)
 
     @property
     def income(self):
@@ -209,35 +398,106 @@ class ItemCounter(collections.Counter):
         return f'{item}({num}{unit})'
 
 
+class Scheduler:
+    """遅延実行の予定表
+
+    期限順のヒープで予定を持つ。自前のスレッドは持たず、
+    消費側のループがtimeout()秒だけ待ってからrun_pending()を呼ぶ。
+    debounceは同じkeyの予定を取り消してから入れ直す。
+    取り消した予定はヒープに残し、取り出す時に読み飛ばす。
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []  # [期限, 通し番号, fn, args]
+        self.seq = itertools.count()
+        self.keys = {}
+        self.cancelled = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def call_at(self, deadline, fn, *args):
+        """時刻deadline (clockの値) にfn(*args)を呼ぶ。取り消し用の予定を返す"""
+        timer = [deadline, next(self.seq), fn, args]
+        with self.lock:
+            heapq.heappush(self.heap, timer)
+        return timer
+
+    def call_later(self, delay, fn, *args):
+        return self.call_at(self.clock() + delay, fn, *args)
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer[2] is None:
+                return
+            timer[2] = None
+            self.cancelled += 1
+            if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+                self.heap = [x for x in self.heap if x[2] is not None]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def debounce(self, key, delay, fn, *args):
+        """keyの予定をdelay秒後に入れ直す"""
+        timer = self.keys.get(key)
+        if timer is not None:
+            self.cancel(timer)
+        self.keys[key] = timer = self.call_later(delay, self._fire, key, fn,
+                                                 args)
+        return timer
+
+    def _fire(self, key, fn, args):
+        del self.keys[key]
+        fn(*args)
+
+    def timeout(self, limit=None):
+        """次の予定までの秒数。limitより長ければlimitを返す"""
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][2] is None:
+                heapq.heappop(heap)
+                self.cancelled -= 1
+            if not heap:
+                return limit
+            t = max(0.0, heap[0][0] - self.clock())
+        return t if limit is None else min(t, limit)
+
+    def run_pending(self):
+        """期限の来た予定を実行し、実行した数を返す"""
+        n = 0
+        now = self.clock()
+        while True:
+            with self.lock:
+                heap = self.heap
+                if not heap or heap[0][0] > now:
+                    return n
+                timer = heapq.heappop(heap)
+                fn, args = timer[2], timer[3]
+                if fn is None:
+                    self.cancelled -= 1
+                    continue
+                timer[2] = None
+            fn(*args)
+            n += 1
+
+
 class DelayedReporter:
+    """最後にputしてからdelay秒経ったら、それまでの分をまとめてcallbackへ渡す"""
+
     delay = 30
 
-    def __init__(self, callback):
+    def __init__(self, callback, scheduler):
         self.callback = callback
+        self.scheduler = scheduler
         self.counter = ItemCounter()
-        self.expiry = 0
-        self.added = False
-        self.coro = self.main()
-
-    def update(self):
-        next(self.coro)
 
     def put(self, item, num):
         self.counter.add(item, num)
-        self.expiry = time.time() + self.delay
-        self.added = True
+        self.scheduler.debounce(self, self.delay, self.report)
 
-    def main(self):
-        while True:
-            while not self.added:
-                yield
-
-            while self.added:
-                self.added = False
-                while time.time() < self.expiry:
-                    yield
-
-            counter = self.counter
-            self.counter = ItemCounter()
-
-            self.callback(counter)
+    def report(self):
+        counter = self.counter
+        self.counter = ItemCounter()
+        self.callback(counter)
@@ -0,0 +1,110 @@
+"""エントリ毎の処理段階の時刻を記録して遅延の内訳を集計する
+
+段階は次の順に進む。
+    written    : ログファイルに書き込まれた (ファイルの更新時刻から推定。
+                 更新時刻の分解能は数ms程度なので、それより細かい差は測れない)
+    detected   : 監視がファイルの変化を検出した
+    parsed     : Entryになった
+    released   : 並べ替え(ReorderBuffer)を抜けた
+    dispatched : main.on_entryで処理された
+    sent       : 棒読みちゃんへ送信された (読み上げがあった場合のみ)
+
+各段階について直前の段階からの経過時間をヒストグラムに集計する。
+既定では無効で、無効の時にEntryへ記録されるものは無い。
+"""
+import bisect
+import threading
+import time
+
+STAGES = ("written", "detected", "parsed", "released", "dispatched", "sent")
+
+enabled = False
+
+# バケットの上限 (ミリ秒)
+BOUNDS = [0.125 * 2 ** i for i in range(17)]  # 0.125ms ~ 8192ms
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        """バケットの上限で近似した百分位数"""
+        rank = self.count * p
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= rank and n:
+                return min(BOUNDS[i], self.max) if i < len(BOUNDS) \
+                    else self.max
+        return 0.0
+
+
+histograms = {stage: Histogram() for stage in STAGES[1:]}
+_lock = threading.Lock()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        for stage in histograms:
+            histograms[stage] = Histogram()
+
+
+def start(written=None, detected=None):
+    """writtenとdetectedの時刻を持つ新しいtraceを返す"""
+    trace = [written]
+    mark(trace, "detected", detected)
+    return trace
+
+
+def wall2perf(ns):
+    """time.time_ns()の時刻をperf_counterの時刻に換算する"""
+    return time.perf_counter() - (time.time_ns() - ns) / 1e9
+
+
+def mark(trace, stage, now=None):
+    """traceにstageの時刻を記録し、直前の段階からの経過を集計する"""
+    if now is None:
+        now = time.perf_counter()
+    i = STAGES.index(stage)
+    if len(trace) < i:
+        # 途中の段階が記録されていない
+        trace.extend([None] * (i - len(trace)))
+    prev = next((t for t in reversed(trace[:i]) if t is not None), None)
+    if len(trace) == i:
+        trace.append(now)
+    else:
+        trace[i] = now
+    if prev is not None:
+        with _lock:
+            histograms[stage].add((now - prev) * 1000)
+
+
+def dump():
+    """段階毎の遅延の集計を文字列で返す"""
+    lines = [f"{'stage':11} {'count':>7} {'mean':>9} {'p50':>9}"
+             f" {'p99':>9} {'max':>9} (ms, from previous stage)"]
+    with _lock:
+        for stage, h in histograms.items():
+            if not h.count:
+                lines.append(f"{stage:11} {0:7}")
+                continue
+            lines.append(
+                f"{stage:11} {h.count:7} {h.total / h.count:9.3f}"
+                f" {h.percentile(0.5):9.3f} {h.percentile(0.99):9.3f}"
+                f" {h.max:9.3f}")
+    return "\n".join(lines)
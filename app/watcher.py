@@ -0,0 +1,122 @@
+"""ログフォルダの変更監視
+
+Linuxではinotifyで書き込み・作成されたファイルだけを通知する。
+inotifyが使えない環境では従来通り一定間隔のポーリングにフォールバックする。
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class PollingWatcher:
+    """一定間隔で起床するだけの監視 (どのファイルが変化したかは分からない)"""
+
+    interval = 0.5
+
+    def __init__(self, dirs):
+        self.dirs = list(dirs)
+
+    def wait(self, timeout=None):
+        """変化したファイルのsetを返す。Noneは「全て確認せよ」を意味する"""
+        if timeout is None:
+            timeout = self.interval
+        time.sleep(min(self.interval, timeout))
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """inotifyによるイベント駆動の監視"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE)
+
+    _event = struct.Struct("iIII")
+
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.wds = {}
+        for path in dirs:
+            wd = libc.inotify_add_watch(
+                self.fd, os.fsencode(path), self.MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch",
+                              str(path))
+            self.wds[wd] = Path(path)
+
+    def wait(self, timeout=0.5):
+        """変化したファイルのsetを返す。タイムアウトなら空のset"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, size = self._event.unpack_from(buf, offset)
+            offset += self._event.size
+            name = buf[offset:offset + size].rstrip(b"\0")
+            offset += size
+            if mask & self.IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow")
+                return None
+            if wd in self.wds and name:
+                changed.add(self.wds[wd].joinpath(os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+backends = {
+    "inotify": InotifyWatcher,
+    "polling": PollingWatcher,
+}
+
+
+def create(dirs, backend=None):
+    """利用可能な監視を生成する
+
+    backendを省略するとLinuxではinotify、それ以外ではポーリングを使う。
+    """
+    if backend is None:
+        backend = "inotify" if sys.platform.startswith("linux") else "polling"
+    if backend != "polling":
+        try:
+            watcher = backends[backend](dirs)
+            logger.debug(f"watcher: {backend}")
+            return watcher
+        except (OSError, AttributeError) as e:
+            logger.warning(f"{backend} unavailable: {e}")
+    logger.debug("watcher: polling")
+    return PollingWatcher(dirs)
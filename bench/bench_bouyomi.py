@@ -0,0 +1,115 @@
+"""棒読みちゃんへの送信の処理量を測る
+
+    python -m bench.bench_bouyomi [--count N] [--latency MS]
+
+FakeBouyomiへcount件を送り、全て届くまでの時間を比べる。
+    sync : 以前の送り方 (1件ずつ接続して送る)
+    async: bouyomichan.Sender
+latencyを指定すると接続にその分の遅延を入れて、遠いホストを模す。
+outageを指定すると、サーバがその秒数止まっている間も送り続け、
+復帰後に届いた数と捨てられた数を表示する (asyncのみ)。
+"""
+import argparse
+import asyncio
+import socket
+import time
+from unittest import mock
+
+from app import bouyomichan
+
+from .fakebouyomi import FakeBouyomi
+
+
+def slow_connect(latency):
+    connect = socket.socket.connect
+    open_connection = asyncio.open_connection
+
+    def sync(self, address):
+        time.sleep(latency)
+        return connect(self, address)
+
+    async def aio(*args, **kwargs):
+        await asyncio.sleep(latency)
+        return await open_connection(*args, **kwargs)
+
+    # asyncioもsocket.connectを使うので、それぞれの実行中だけ差し替える
+    return {"sync": mock.patch.object(socket.socket, "connect", sync),
+            "async": mock.patch.object(asyncio, "open_connection", aio)}
+
+
+def run_sync(server, texts):
+    for text in texts:
+        bouyomichan.talk(text, putq=False, host=server.address)
+
+
+def run_async(server, texts, connections):
+    sender = bouyomichan.Sender(server.address, connections)
+    sender.backlog = len(texts)
+    for text in texts:
+        sender.put(text, {})
+    return sender
+
+
+def run_outage(texts, outage, connections):
+    """サーバが止まっている間にtextsを流し、再起動後の結果を返す"""
+    server = FakeBouyomi()
+    address = server.address
+    server.close()
+    sender = bouyomichan.Sender(address, connections)
+    interval = outage / len(texts)
+    t = time.perf_counter()
+    for text in texts:
+        sender.put(text, {})
+        time.sleep(interval)
+    server = FakeBouyomi(*address)
+    server.wait(len(texts) - sender.backlog, timeout=sender.retry_after_max)
+    time.sleep(0.5)
+    sender.close()
+    server.close()
+    print(f"outage {outage}s: {len(server.received)}/{len(texts)} delivered"
+          f" after {time.perf_counter() - t:.1f} s")
+    print(f"       {dict(sender.stats)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="接続の遅延 (ms)")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--outage", type=float,
+                        help="サーバが止まっている秒数")
+    args = parser.parse_args()
+
+    texts = [f"テスト{i} " + "あ" * (i % 40) for i in range(args.count)]
+    if args.outage:
+        run_outage(texts, args.outage, args.connections)
+        return
+    patches = slow_connect(args.latency / 1000) if args.latency else {}
+
+    for name in ("sync", "async"):
+        server = FakeBouyomi()
+        patch = patches.get(name)
+        if patch is not None:
+            patch.start()
+        t = time.perf_counter()
+        if name == "sync":
+            run_sync(server, texts)
+        else:
+            sender = run_async(server, texts, args.connections)
+        ok = server.wait(len(texts), timeout=60)
+        elapsed = time.perf_counter() - t
+        if patch is not None:
+            patch.stop()
+        server.close()
+        in_order = server.texts() == texts
+        print(f"{name:5}: {len(server.received)}/{len(texts)} lines"
+              f" {elapsed:7.3f} s {len(server.received) / elapsed:9,.0f}"
+              f" lines/s in_order={in_order}" + ("" if ok else " TIMEOUT"))
+        if name == "async":
+            sender.close()
+            print(f"       {dict(sender.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""chatcmd.tokenizeと従来のhandle_Chat/stripの処理時間を比べる
+
+病的な入力を含む発言で比較する。
+結果が従来と一致することは tests/test_chatcmd.py で確かめる。
+
+    python -m bench.bench_chatcmd
+"""
+import time
+
+from tests.chatcmd_old import new_path, old_path
+
+
+def bench(fn, messages, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for mess in messages:
+            fn(mess)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    cases = {
+        "typical": ["/la dance こんにちは", "{red}緊急きたー",
+                    "/toge /moya おつかれさま", "普通の発言です"] * 250,
+        "many leading commands": ["/a " * 200 + "end"] * 20,
+        "many colors": ["{red}あ{blu}い" * 200] * 20,
+        "long plain": ["あいうえお" * 400] * 20,
+    }
+    for name, messages in cases.items():
+        t_old = bench(old_path, messages)
+        t_new = bench(new_path, messages)
+        print(f"{name:22}: old {t_old * 1000:8.2f}ms"
+              f"  new {t_new * 1000:8.2f}ms  x{t_old / t_new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""台帳への記録と問い合わせの速さを測る
+
+    python -m bench.bench_ledger [--days N] [--rate N]
+
+1日あたりrate件 (既定2万件) をdays日分記録してから、
+集計表を使う問い合わせの所要時間を表示する。
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.ledger import Ledger
+
+ITEMS = ["N-メセタ", "メセタ", "スタージェム", "モノメイト", "ディメイト",
+         "グラインダー", "フォトンスフィア"] + [f"武器{i}" for i in range(200)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--rate", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    start = now - args.days * 86400
+    n = args.days * args.rate
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = Ledger(os.path.join(tmp, "ledger.db"))
+        t = time.perf_counter()
+        for i in range(n):
+            ts = start + i * args.days * 86400 // n
+            ledger.record(ts, rng.choice(ITEMS), rng.randint(1, 1000),
+                          rng.random() < 0.8)
+        ledger.flush()
+        elapsed = time.perf_counter() - t
+        print(f"record   : {n} rows, {n / elapsed:,.0f} rows/s")
+
+        queries = {
+            "meseta per hour, week": lambda: ledger.series(
+                "N-メセタ", "hour", since=now - 7 * 86400),
+            "stargem today": lambda: ledger.today("スタージェム"),
+            "all items today": lambda: ledger.today(),
+            "per minute, last hour": lambda: ledger.series(
+                "N-メセタ", "minute", since=now - 3600),
+        }
+        for name, query in queries.items():
+            t = time.perf_counter()
+            for _ in range(20):
+                result = query()
+            ms = (time.perf_counter() - t) / 20 * 1000
+            print(f"{name:22}: {ms:7.3f} ms ({len(result)} rows)")
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
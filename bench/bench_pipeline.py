@@ -0,0 +1,121 @@
+"""LogPump → main.on_entry の端から端までのスループットと遅延を計測する
+
+合成ログ(bench.loggen)を書き込みながらヘッドレスのパイプラインを動かし、
+entries/s、書き込みからdispatchまでのp50/p99遅延、ピークRSSを表示する。
+読み上げは本物の棒読みちゃんではなくFakeBouyomiへ送る。
+
+    python -m bench.bench_pipeline [--rate 500] [--duration 10] [--backend inotify]
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from app import bouyomichan, headless, tracing
+from app import main as Main
+
+from .fakebouyomi import FakeBouyomi
+from .loggen import LogGenerator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Linuxではキロバイト単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    i = min(len(sorted_values) - 1, int(len(sorted_values) * p))
+    return sorted_values[i]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=500,
+                        help="1秒あたりの書き込みレコード数")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--backend", choices=["inotify", "polling"])
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--multiline", type=float, default=0.05)
+    parser.add_argument("--partial", type=float, default=0.05)
+    parser.add_argument("--trace", action="store_true",
+                        help="段階毎の遅延の内訳も表示する")
+    args = parser.parse_args()
+    tracing.enable(args.trace)
+
+    server = FakeBouyomi()
+    sender = bouyomichan.talk.sender = bouyomichan.Sender(
+        server.address, summaries=Main.TALK_SUMMARIES)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp, "log")
+        folder.mkdir()
+        gen = LogGenerator(folder, multiline=args.multiline,
+                           partial=args.partial)
+
+        latency = []
+        dispatched = 0
+
+        def recorder(ent):
+            nonlocal dispatched
+            now = time.perf_counter()
+            written = gen.written.get((ent.category, ent.sequence))
+            if written is not None:
+                latency.append(now - written)
+            dispatched += 1
+
+        def dispatch(ent):
+            Main.on_entry(ent)
+            recorder(ent)
+
+        stop = threading.Event()
+        th = threading.Thread(target=headless.run, kwargs=dict(
+            roots=[folder], sink_fns=[dispatch], backend=args.backend,
+            workers=args.workers, stop=stop))
+        th.start()
+        time.sleep(0.5)  # 読み取り位置の確定を待つ
+
+        start = time.perf_counter()
+        written = gen.run(args.rate, args.duration)
+        # 書き終えた分が届くのを待つ
+        deadline = time.perf_counter() + 5
+        while dispatched < written and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        th.join()
+        gen.close()
+
+    sender.close()
+    del bouyomichan.talk.sender
+    server.close()
+
+    latency = sorted(x * 1000 for x in latency)
+    rss = peak_rss_mb()
+    print(f"written    : {written}")
+    print(f"dispatched : {dispatched}")
+    print(f"entries/s  : {dispatched / elapsed:,.0f}")
+    print(f"talked     : {len(server.received)} {dict(sender.stats)}")
+    if latency:
+        print(f"latency ms : mean={statistics.mean(latency):.2f}"
+              f" p50={percentile(latency, 0.50):.2f}"
+              f" p99={percentile(latency, 0.99):.2f}"
+              f" max={latency[-1]:.2f}")
+    if rss is not None:
+        print(f"peak RSS   : {rss:.1f} MB")
+    if args.trace:
+        print(tracing.dump())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""split_recordsと従来のcsv.excel_tab経由の解析のスループットを比較する
+
+    python -m bench.bench_records [-n 20000] [--long 2000]
+"""
+import argparse
+import csv
+import random
+import time
+
+from app.logpump import split_records
+
+
+def sample(n, long_len):
+    rnd = random.Random(0)
+    lines = []
+    for seq in range(n):
+        head = f"2021-06-01T12:00:00\t{seq}\tPUBLIC\t10000001\tname\t"
+        r = rnd.random()
+        if r < 0.8:
+            mess = "こんにちは /la dance"
+        elif r < 0.95:
+            mess = '"複数行の\r\nメッセージ ""引用"" です"'
+        else:
+            # 長い貼り付け
+            body = "\r\n".join("あいうえお" * 8 for _ in range(long_len // 40))
+            mess = f'"{body}"'
+        lines.append(head + mess + "\r\n")
+    return "".join(lines)
+
+
+def csv_path(text):
+    # 従来の_tail相当: クォートの数を数えながら行を連結してからcsvへ渡す
+    ls = []
+    it = iter(text.split("\n")[:-1])
+    for line in it:
+        line += "\n"
+        ls.append(line)
+        while line.count('"') % 2 == 1:
+            trail = next(it) + "\n"
+            ls.append(trail)
+            line += trail
+    return list(csv.reader(ls, dialect=csv.excel_tab))
+
+
+def new_path(text):
+    return list(split_records(text))
+
+
+def bench(fn, text, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        rows = fn(text)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000)
+    parser.add_argument("--long", type=int, default=2000,
+                        help="長い貼り付けメッセージの文字数")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    text = sample(args.n, args.long)
+    expected, t_csv = bench(csv_path, text, args.repeat)
+    rows, t_new = bench(new_path, text, args.repeat)
+    assert rows == expected, "split_records differs from csv.excel_tab"
+
+    mb = len(text) * 2 / 1e6  # UTF-16
+    for name, t in [("csv.excel_tab", t_csv), ("split_records", t_new)]:
+        print(f"{name:14}: {t * 1000:8.1f}ms"
+              f" {len(rows) / t:10,.0f} records/s {mb / t:7.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
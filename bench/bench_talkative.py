@@ -0,0 +1,73 @@
+"""TalkativesDetectorの1件あたりの処理時間を測る
+
+    python -m bench.bench_talkative [--rate N] [--window SEC]
+
+rate件/秒の発言をwindow秒分流し続けた状態 (window*rate件を覚えている) で、
+以前の実装 (全件走査) と比べる。時刻は擬似的に進める。
+"""
+import argparse
+import heapq
+import random
+import time
+from unittest import mock
+
+from app import misc
+
+
+class Reference:
+    """以前の実装"""
+
+    def __init__(self):
+        self.heap = []
+
+    def __call__(self, text, period=60):
+        now = time.monotonic()
+        heap = self.heap
+        while heap and heap[0][0] < now:
+            heapq.heappop(heap)
+        exists = any(map(lambda x: x[1] == text, heap))
+        heapq.heappush(heap, (now + period, text))
+        return exists
+
+
+def run(detector, texts, rate, window):
+    clock = [0.0]
+    step = 1 / rate
+    results = []
+    with mock.patch.object(time, "monotonic", lambda: clock[0]):
+        # 監視期間いっぱいまで溜める
+        for text in texts[:int(rate * window)]:
+            clock[0] += step
+            detector(text, window)
+        rest = texts[int(rate * window):]
+        t = time.perf_counter()
+        for text in rest:
+            clock[0] += step
+            results.append(detector(text, window))
+        elapsed = time.perf_counter() - t
+    return elapsed / len(rest) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--window", type=float, default=60)
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'rate/s':>7} {'held':>6} {'old us':>9} {'new us':>9}")
+    for rate in (1, 10, 50, 200):
+        n = int(rate * args.window) + args.count
+        vocab = [f"message {i}" for i in range(max(10, rate * 20))]
+        texts = [rng.choice(vocab) for _ in range(n)]
+        old, r1 = run(Reference(), texts, rate, args.window)
+        # 結果を比べるため、件数の上限で忘れることが無いようにする
+        new, r2 = run(misc.TalkativesDetector(maxlen=n), texts, rate,
+                      args.window)
+        assert r1 == r2, "results differ"
+        print(f"{rate:7} {int(rate * args.window):6} {old:9.2f} {new:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
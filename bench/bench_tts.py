@@ -0,0 +1,118 @@
+"""チャットが殺到した時の読み上げの遅れを測る
+
+    python -m bench.bench_tts [--duration SEC] [--chat N]
+
+読み上げ速度を模したFakeBouyomiへ、公開チャットをchat件/秒と
+スタンプを1件/秒流しながら、ささやきと警告を時々混ぜる。種類毎に、
+読み上げられた数とtalkしてから読み上げが始まるまでの時間を表示する。
+    fifo    : 優先度・期限・タスク数の確認なし (以前と同じ振る舞い)
+    priority: bouyomichan.Senderの既定
+    coalesce: さらにcoalesce.Coalescerを通す
+まとめられた文は元の文と一致しないので、spokenには数えない。
+"""
+import argparse
+import collections
+import statistics
+import time
+
+from app import bouyomichan, coalesce, misc
+from app import main as Main
+
+from .fakebouyomi import FakeBouyomi
+
+KINDS = {
+    "warning": Main.PRIO_WARNING,
+    "whisper": Main.PRIO_WHISPER,
+    "chat": Main.PRIO_CHAT,
+    "stamp": Main.PRIO_CHAT,
+}
+
+
+def schedule(duration, chat_rate):
+    """(送る時刻, 種類, 名前, 文) のリスト"""
+    events = []
+    n = int(duration * chat_rate)
+    for i in range(n):
+        name = f"名前{i % 7}"
+        events.append((i / chat_rate, "chat", name, f"{name}「こんにちは{i}」"))
+    for i in range(int(duration)):
+        name = f"名前{i % 3}"
+        events.append((i + 0.5, "stamp", name, f"{name}のスタンプ{i}"))
+    for i in range(int(duration / 4)):
+        events.append((i * 4 + 1.3, "whisper", None, f"フレンド「ささやき{i}」"))
+    for i in range(int(duration / 5)):
+        events.append((i * 5 + 2.7, "warning", None, f"警告{i}"))
+    events.sort()
+    return events
+
+
+def run(mode, events, speech_rate, tail):
+    server = FakeBouyomi(speech_rate=speech_rate)
+    if mode == "fifo":
+        sender = bouyomichan.Sender(server.address)
+        sender.max_tasks = None
+        sender.max_age = (3600.0,) * len(sender.max_age)
+    else:
+        sender = bouyomichan.Sender(
+            server.address, summaries=Main.TALK_SUMMARIES)
+    scheduler = misc.Scheduler()
+    coalescer = coalesce.Coalescer(
+        lambda text, **kwargs: sender.put(text, kwargs), scheduler,
+        lambda: len(sender) + sender.tasks, min_priority=Main.PRIO_CHAT)
+    put = {}
+    t0 = time.perf_counter()
+    for at, kind, name, text in events:
+        while True:
+            scheduler.run_pending()
+            delay = t0 + at - time.perf_counter()
+            if delay <= 0:
+                break
+            time.sleep(min(delay, scheduler.timeout(delay)))
+        put[text] = (kind, time.perf_counter())
+        priority = KINDS[kind] if mode != "fifo" else Main.PRIO_CHAT
+        if mode == "coalesce":
+            coalescer.put(text, kind if name else None, name,
+                          priority=priority)
+        else:
+            sender.put(text, {"priority": priority})
+    time.sleep(tail)
+    scheduler.run_pending()
+    sender.close()
+    server.close()
+
+    end = time.perf_counter()
+    latency = collections.defaultdict(list)
+    for start, text in server.spoken:
+        if text in put and start <= end:
+            kind, t = put[text]
+            latency[kind].append(start - t)
+    total = collections.Counter(kind for kind, _ in put.values())
+    print(f"{mode}: {dict(sender.stats)}")
+    if mode == "coalesce":
+        print(f"  coalesce: {coalescer.snapshot()}")
+    for kind in KINDS:
+        ls = latency[kind]
+        if ls:
+            print(f"  {kind:8} spoken {len(ls):4}/{total[kind]:<4}"
+                  f" wait p50={statistics.median(ls):6.2f}s"
+                  f" max={max(ls):6.2f}s")
+        else:
+            print(f"  {kind:8} spoken    0/{total[kind]:<4}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--chat", type=float, default=2,
+                        help="公開チャットの件数/秒")
+    parser.add_argument("--speech-rate", type=float, default=12,
+                        help="読み上げ速度 (文字/秒)")
+    args = parser.parse_args()
+
+    events = schedule(args.duration, args.chat)
+    for mode in ("fifo", "priority", "coalesce"):
+        run(mode, events, args.speech_rate, tail=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""書き込みからcallback呼び出しまでの時間を監視バックエンド毎に計測する
+
+    python -m bench.bench_watch [-n 200] [--interval 0.05]
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app import logpump
+
+
+def chat_line(seq):
+    ts = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{ts}\t{seq}\tPUBLIC\t10000001\tbench\tmessage {seq}\r\n"
+
+
+def measure(backend, count, interval):
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp, "log")
+        folder.mkdir()
+        path = folder.joinpath("ChatLog20210601_00.txt")
+        path.write_bytes(b"\xff\xfe")
+
+        written = {}
+        latency = []
+        done = threading.Event()
+
+        def callback(ent):
+            latency.append(time.perf_counter() - written[ent.sequence])
+            if len(latency) >= count:
+                done.set()
+
+        pump = logpump.LogPump(callback, [folder], backend)
+        pump.start()
+        try:
+            with path.open("ab") as f:
+                for seq in range(count):
+                    written[seq] = time.perf_counter()
+                    f.write(chat_line(seq).encode("utf-16-le"))
+                    f.flush()
+                    time.sleep(interval)
+            done.wait(5)
+        finally:
+            pump.stop()
+
+    return type(pump.watcher).__name__, latency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    for backend in ["polling", "inotify"]:
+        name, latency = measure(backend, args.n, args.interval)
+        if not latency:
+            print(f"{backend:8} ({name}): no entries")
+            continue
+        latency = sorted(x * 1000 for x in latency)
+        p99 = latency[int(len(latency) * 0.99) - 1]
+        print(f"{backend:8} ({name}): n={len(latency)}"
+              f" mean={statistics.mean(latency):.2f}ms"
+              f" p50={statistics.median(latency):.2f}ms"
+              f" p99={p99:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
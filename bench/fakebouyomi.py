@@ -0,0 +1,105 @@
+"""棒読みちゃんの代わりに受信だけするサーバ
+
+本物と同じく、接続を1つずつ受け付けて1つのコマンドを読んでから次へ進む。
+受け取った読み上げ文は received に (受信時刻, 文) で溜まる。
+speech_rateを指定すると1秒にその文字数を読み上げるものとして、
+読み上げ始める時刻を spoken に (時刻, 文) で記録し、
+GetTaskCount・GetNowPlayingにその状態で答える。
+"""
+import collections
+import socket
+import struct
+import threading
+import time
+
+from app.bouyomichan import Cmd
+
+_header = struct.Struct("<hhhhhbL")
+
+
+class FakeBouyomi:
+    def __init__(self, host="127.0.0.1", port=0, speech_rate=None):
+        self.sock = socket.create_server((host, port), backlog=128)
+        self.address = self.sock.getsockname()
+        self.received = []
+        self.speech_rate = speech_rate
+        self.spoken = []
+        self.tasks = collections.deque()  # (読み上げ開始時刻, 文)
+        self.busy_until = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def texts(self):
+        return [text for _, text in self.received]
+
+    def wait(self, n, timeout=10):
+        """n件受け取るまで待つ"""
+        deadline = time.monotonic() + timeout
+        while len(self.received) < n and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return len(self.received) >= n
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+    def reply(self, cmd):
+        """Talk以外のコマンドへの応答"""
+        self._advance()
+        if cmd == Cmd.GetTaskCount:
+            return len(self.tasks).to_bytes(4, "little")
+        if cmd == Cmd.GetNowPlaying:
+            playing = time.perf_counter() < self.busy_until
+            return int(playing).to_bytes(4, "little")
+        return (0).to_bytes(4, "little")
+
+    def _advance(self):
+        """読み上げ始めた文をtasksから除く"""
+        now = time.perf_counter()
+        while self.tasks and self.tasks[0][0] <= now:
+            self.tasks.popleft()
+
+    def _speak(self, text):
+        now = time.perf_counter()
+        start = max(now, self.busy_until)
+        self.busy_until = start + len(text) / self.speech_rate
+        self.tasks.append((start, text))
+        self.spoken.append((start, text))
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    self._handle(conn)
+                except OSError:
+                    pass
+
+    def _handle(self, conn):
+        cmd = self._recv(conn, 2)
+        if len(cmd) < 2:
+            return  # 何も送らずに閉じられた
+        cmd = int.from_bytes(cmd, "little")
+        if cmd != Cmd.Talk:
+            conn.sendall(self.reply(cmd))
+            return
+        rest = self._recv(conn, _header.size - 2)
+        size = _header.unpack(cmd.to_bytes(2, "little") + rest)[-1]
+        text = self._recv(conn, size).decode("utf-8")
+        self.received.append((time.perf_counter(), text))
+        if self.speech_rate is not None:
+            self._speak(text)
+
+    @staticmethod
+    def _recv(conn, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                break
+            buf += chunk
+        return buf
@@ -0,0 +1,158 @@
+"""PSO2のログを模したUTF-16-LEのログファイルを書き出す
+
+Entryが解釈するのと同じ形式で Chat, Action, Reward, Craft, Scratch, StarGem の
+ログを指定したレートで書く。複数行のクォートされたメッセージや、
+レコードを途中で区切った書き込み(書きかけの状態)も混ぜる。
+
+    python -m bench.loggen OUTDIR [--rate 200] [--duration 10]
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+
+BOM = b"\xff\xfe"
+
+CHANNELS = ["PUBLIC"] * 6 + ["PARTY", "GUILD", "REPLY", "GROUP"]
+NAMES = ["アークス", "ゼノ", "エコー", "マトイ", "Player01", "Player02"]
+MESSAGES = [
+    "こんにちは",
+    "よろしくお願いします",
+    "/la dance",
+    "/mla monomane",
+    "/stamp 123",
+    "/cs 星空のドレス",
+    "{red}緊急きたー",
+    "/toge /moya おつかれさま",
+    "/ci1 2 t3 移動します",
+]
+ITEMS = ["モノメイト", "ディメイト", "アースシェル", "フォトンドロップ",
+         "モジュール／アタック", "ナベルタートル", "EXPスーパーチケット"]
+
+# カテゴリ毎の比率
+MIX = {
+    "Chat": 6,
+    "Action": 6,
+    "Reward": 1,
+    "Craft": 1,
+    "Scratch": 1,
+    "StarGem": 1,
+}
+
+
+class LogGenerator:
+    """ログフォルダへ合成ログを書き込む"""
+
+    def __init__(self, folder, seed=0, multiline=0.05, partial=0.05):
+        """
+        multiline: 複数行メッセージの割合
+        partial: レコードを2回に分けて書く割合
+        """
+        self.folder = Path(folder)
+        self.rnd = random.Random(seed)
+        self.multiline = multiline
+        self.partial = partial
+        self.seq = {}
+        self.files = {}
+        self.written = {}  # (category, sequence) -> 書き込み完了時刻
+        stamp = datetime.now().strftime("%Y%m%d")
+        for cate in MIX:
+            path = self.folder.joinpath(f"{cate}Log{stamp}_00.txt")
+            path.write_bytes(BOM)
+            self.files[cate] = path.open("ab")
+            self.seq[cate] = 0
+
+    def close(self):
+        for fp in self.files.values():
+            fp.close()
+
+    def fields(self, cate):
+        rnd = self.rnd
+        pid = str(10000000 + rnd.randrange(100))
+        name = rnd.choice(NAMES)
+        item = rnd.choice(ITEMS)
+        num = f"Num({rnd.randint(1, 5)})"
+        if cate == "Chat":
+            mess = rnd.choice(MESSAGES)
+            if rnd.random() < self.multiline:
+                body = "\r\n".join([mess, "二行目", '"引用"付き'] * rnd.randint(1, 5))
+                mess = '"' + body.replace('"', '""') + '"'
+            return [rnd.choice(CHANNELS), pid, name, mess]
+        if cate == "Action":
+            if rnd.random() < 0.3:
+                return ["[Pickup]", pid, name, "Meseta",
+                        f"Meseta({rnd.randint(1, 500)})"]
+            return ["[Pickup]", pid, name, item, num]
+        if cate == "Reward":
+            return ["[Reward]", pid, name, item, num]
+        if cate == "Craft":
+            return ["[Material]", pid, name, item, num]
+        if cate == "Scratch":
+            return ["[Scratch]", "Received", pid, name, item, num]
+        if cate == "StarGem":
+            gem = rnd.randint(1, 30)
+            return ["[Add]", pid, name, str(gem), "Free", str(1000 + gem)]
+        raise ValueError(cate)
+
+    def record(self, cate):
+        seq = self.seq[cate]
+        self.seq[cate] += 1
+        ts = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        line = "\t".join([ts, str(seq)] + self.fields(cate)) + "\r\n"
+        return seq, line.encode("utf-16-le")
+
+    def write(self, cate):
+        """1レコード書き込み、(category, sequence)を返す"""
+        seq, data = self.record(cate)
+        fp = self.files[cate]
+        if self.rnd.random() < self.partial:
+            cut = self.rnd.randrange(1, len(data) // 2) * 2
+            fp.write(data[:cut])
+            fp.flush()
+            time.sleep(0.001)
+            data = data[cut:]
+        fp.write(data)
+        fp.flush()
+        self.written[cate, seq] = time.perf_counter()
+        return cate, seq
+
+    def choose(self):
+        return self.rnd.choices(list(MIX), weights=list(MIX.values()))[0]
+
+    def run(self, rate, duration, stop=None):
+        """rate件/秒でduration秒間書き込む"""
+        start = time.perf_counter()
+        count = 0
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration or (stop is not None and stop.is_set()):
+                break
+            due = int(elapsed * rate)
+            while count < due:
+                self.write(self.choose())
+                count += 1
+            time.sleep(0.002)
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outdir")
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    folder = Path(args.outdir)
+    folder.mkdir(parents=True, exist_ok=True)
+    gen = LogGenerator(folder, args.seed)
+    try:
+        n = gen.run(args.rate, args.duration)
+    finally:
+        gen.close()
+    print(f"{n} records written to {folder}")
+
+
+if __name__ == "__main__":
+    main()
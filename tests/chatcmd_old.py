@@ -0,0 +1,45 @@
+"""chatcmd.tokenize以前のhandle_Chat/stripの処理
+
+tests/test_chatcmd.pyで結果を、bench/bench_chatcmd.pyで処理時間を比べる。
+"""
+import re
+
+from app import chatcmd
+
+old_cmd_rex = [
+    'toge|moya|[apt]',
+    '(mn|vo|symbol|' 'spage|swp|' 'mainpalette|mpal|'
+    'subpalette|spal|' 'myset|ms|' 'myfashion|mf)' r'\d+',
+    r'(face\d|fc\d|ce(all)?)' '( +(on|off))?',
+    r'uioff( +\d+)?',
+    r'ci\d+( +\d+)?( +t[1-5])?( +\d+)?',
+    '(skillring|sr|' 'costume|cs|' 'camouflage|cmf)' ' +[^ ]+',
+    r'[cfm]?la +[^ ]+( +ss?(\d+(\.\d+)?))?',
+    r'ce\d( +s(\d+(\.\d+)?))?',
+    r'stamp +[^ ]',
+]
+old_cmd_rex = re.compile(r'^/(' + '|'.join(old_cmd_rex) + r') ?')
+
+
+def old_strip(text):
+    text = chatcmd.color_rex.sub('', text)
+    prev = None
+    while text and text != prev:
+        prev = text.lstrip()
+        text = old_cmd_rex.sub('', text).lstrip()
+    return text
+
+
+def old_path(mess):
+    la = re.search(r'/[cmf]?la +([^ ]+)', mess)
+    equip = re.search(
+        r'/(skillring|sr|costume|cs|camouflage|cmf) +([^ ]+)', mess)
+    stamp = re.search(r'/stamp +[^ ]+', mess)
+    return (la and la.group(1), equip and equip.group(2),
+            stamp is not None, old_strip(mess))
+
+
+def new_path(mess):
+    tok = chatcmd.tokenize(mess)
+    return (tok.arg("la"), tok.arg("equip"),
+            tok.arg("stamp") is not None, tok.text)
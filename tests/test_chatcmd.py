@@ -0,0 +1,77 @@
+"""chatcmd.tokenizeを従来のhandle_Chat/stripの処理と比べる
+
+従来の処理との意図的な違いは次の2点で、比較の前に入力を揃えている。
++ コマンドは色指定を除いてから探す ("/la {red}dance" は dance)
++ 先頭が空白でも先頭のコマンドを除く (従来は空白があると何も除かなかった)
+"""
+import random
+
+import pytest
+
+from app import chatcmd
+from .chatcmd_old import new_path, old_path
+
+PIECES = [
+    "/la", "/mla", "/cla", "/la dance", "/stamp", "/stamp 12", "/cs",
+    "/cs ドレス", "/sr リング", "/toge", "/moya", "/a", "/p", "/t",
+    "/mn1", "/fc1 on", "/ce", "/ce1 s1.5", "/ci1 2 t3 4", "/uioff 5",
+    "{red}", "{def}", "{xyz}", " ", "  ", "　", "こんにちは", "hello",
+    "/", "dance", "1", "s1", "ss0.5", "/la/la", "a/la x",
+]
+
+
+def reference(mess):
+    """従来の処理に、意図的な違いを反映したもの"""
+    return old_path(chatcmd.color_rex.sub("", mess).lstrip())
+
+
+def random_messages(count, seed=0):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rnd.choice(PIECES) + rnd.choice(["", " "])
+                      for _ in range(rnd.randint(0, 8)))
+
+
+def test_fuzz():
+    mismatch = [(mess, reference(mess), new_path(mess))
+                for mess in random_messages(20000)
+                if reference(mess) != new_path(mess)]
+    assert mismatch[:5] == []
+
+
+@pytest.mark.parametrize("mess, la, equip, stamp, text", [
+    ("/la dance こんにちは", "dance", None, False, "こんにちは"),
+    ("/mla dance /stamp 3 はい", "dance", None, True, "はい"),
+    ("/cs ドレス", None, "ドレス", False, ""),
+    ("/la /cs ドレス", "/cs", "ドレス", False, "ドレス"),
+    ("a/la x", "x", None, False, "a/la x"),
+    ("{red}緊急{def}きたー", None, None, False, "緊急きたー"),
+    # 意図的な違い
+    ("/la {red}dance", "dance", None, False, ""),
+    ("  /toge こんにちは", None, None, False, "こんにちは"),
+])
+def test_examples(mess, la, equip, stamp, text):
+    assert new_path(mess) == (la, equip, stamp, text)
+
+
+# 従来の処理では時間の掛かった入力
+PATHOLOGICAL = {
+    "many leading commands": "/a " * 2000 + "end",
+    "many colors": "{red}あ{blu}い" * 2000,
+    "many slashes": "/" * 5000,
+    "many la": "/la " * 2000,
+    "long plain": "あいうえお" * 4000,
+}
+
+
+@pytest.mark.parametrize("mess", PATHOLOGICAL.values(),
+                         ids=PATHOLOGICAL.keys())
+def test_pathological(mess):
+    assert new_path(mess) == reference(mess)
+
+
+def test_colors():
+    tok = chatcmd.tokenize("{red}あ{xyz}い{def}")
+    assert tok.colors == ["red", "def"]
+    assert tok.text == "あ{xyz}い"
+    assert chatcmd.strip("{red}/toge あ") == "あ"
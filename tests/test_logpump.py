@@ -0,0 +1,81 @@
+"""LogFileの読み取り開始位置とLogFolderのカーソルによる再開"""
+from app.cursor import CursorStore
+from app.logpump import LogFile, LogFolder
+
+BOM = b"\xff\xfe"
+
+
+def record(seq, mess):
+    return (f"2024-01-01T00:00:{seq:02d}\t{seq}\tPUBLIC\t10000000\t"
+            f"アークス\t{mess}\r\n").encode("utf-16-le")
+
+
+def test_seek_end_fake_header_in_partial_record(tmp_path):
+    """書きかけのメッセージ中のレコード先頭に見える行から読み始めない"""
+    path = tmp_path / "ChatLog20240101_00.txt"
+    path.write_bytes(BOM + record(0, "a") + record(1, '"x')[:-4]
+                     + "\r\n2024-01-01T00:00:00\t9\tz\r\n".encode("utf-16-le"))
+    log = LogFile(path)
+    assert log.tail() == []
+    with path.open("ab") as fp:
+        fp.write('end"\r\n'.encode("utf-16-le") + record(2, "b"))
+    rows = log.tail()
+    assert [row[1] for row in rows] == ["1", "2"]
+    assert rows[0][5] == "x\r\n2024-01-01T00:00:00\t9\tz\r\nend"
+    assert not log.buf
+
+
+def test_seek_end_fake_header_in_complete_record(tmp_path):
+    path = tmp_path / "ChatLog20240101_00.txt"
+    path.write_bytes(BOM + record(0, "a") + record(1, '"x')[:-4]
+                     + "\r\n2024-01-01T00:00:00\t9\tz\r\nend\"\r\n"
+                     .encode("utf-16-le"))
+    log = LogFile(path)
+    assert log.last_seq == 1
+    with path.open("ab") as fp:
+        fp.write(record(2, "b"))
+    assert [row[1] for row in log.tail()] == ["2"]
+
+
+def run(folder, cursor):
+    """起動して読めるだけ読み、配信されたsequenceのリストを返す"""
+    got = []
+    store = CursorStore(cursor)
+    logs = LogFolder(folder, got.append, store)
+    targets = logs.targets()
+    for log in logs.retire():
+        logs.read(log)
+        log.close()
+    for log in targets:
+        logs.read(log)
+    logs.close()
+    store.flush()
+    return [entry.sequence for entry in got]
+
+
+def test_resume_without_delivery(tmp_path):
+    """何も配信しなかった回の後でも、停止中に書かれた分を読む"""
+    path = tmp_path / "ChatLog20240101_00.txt"
+    path.write_bytes(BOM + b"".join(record(i, "a") for i in range(3)))
+    cursor = tmp_path / "cursor.json"
+
+    assert run(tmp_path, cursor) == []  # 初回は末尾から
+    assert run(tmp_path, cursor) == []  # 書き込み無し
+    with path.open("ab") as fp:
+        fp.write(b"".join(record(i, "b") for i in range(3, 6)))
+    assert run(tmp_path, cursor) == [3, 4, 5]
+    assert run(tmp_path, cursor) == []
+
+
+def test_new_file_while_stopped(tmp_path):
+    """何も配信しなかった回の後で作られた翌日のファイルを先頭から読む"""
+    old = tmp_path / "ChatLog20240101_00.txt"
+    old.write_bytes(BOM + record(0, "a"))
+    cursor = tmp_path / "cursor.json"
+
+    assert run(tmp_path, cursor) == []
+    with old.open("ab") as fp:
+        fp.write(record(1, "b"))
+    new = tmp_path / "ChatLog20240102_00.txt"
+    new.write_bytes(BOM + record(0, "c"))
+    assert run(tmp_path, cursor) == [1, 0]